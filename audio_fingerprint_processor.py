@@ -2,6 +2,7 @@
 
 
 import os
+import re
 import sys
 import subprocess
 import argparse
@@ -9,33 +10,33 @@ import json
 import tempfile
 from pathlib import Path
 import time
-from typing import List, Dict, Optional, Tuple
+from typing import List, Dict, Optional, Set, Tuple
 import logging
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
 from threading import Lock
 import threading
 from threading import local
 import platform
 import shutil
+import struct
+import uuid
+from collections import namedtuple
+from itertools import chain, islice
+from functools import lru_cache
+from urllib.parse import urlparse
 
 # Platform-specific library path detection
 SYSTEM = platform.system()
 
-# Auto-restart with correct environment if needed (platform-specific)
-if SYSTEM == 'Darwin':  # macOS
-    if 'DYLD_LIBRARY_PATH' not in os.environ or '/opt/homebrew/lib' not in os.environ.get('DYLD_LIBRARY_PATH', ''):
-        env = os.environ.copy()
-        env['DYLD_LIBRARY_PATH'] = '/opt/homebrew/lib:' + env.get('DYLD_LIBRARY_PATH', '')
-        result = subprocess.run([sys.executable] + sys.argv, env=env)
-        sys.exit(result.returncode)
-elif SYSTEM == 'Linux':
-    # On Linux, LD_LIBRARY_PATH may be needed for custom installs
-    # Usually system packages work without this
-    pass
+# _load_chromaprint only checks that libchromaprint exists (by absolute path); pyacoustid's chromaprint
+# module still opens it by bare file name, so on macOS (Homebrew in /opt/homebrew/lib) it needs
+# DYLD_LIBRARY_PATH - run through bin/run_fingerprinter.sh, or acoustid falls back to fpcalc decoding
 
 import ctypes
-import pandas as pd
-from snowflake_utils import SnowflakeConnector
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from snowflake_utils import SnowflakeConnector, FETCH_BATCH_SIZE
 
 # Configure logging
 logging.basicConfig(
@@ -47,15 +48,414 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Row shape returned by the asset queries (column names as reported by Snowflake)
+Asset = namedtuple('Asset', ['ASSET_ID', 'FILE_KEY', 'FILE_FORMAT', 'FILE_SIZE', 'SOURCE'])
+
+# Unprocessed-asset queries per source (anti-join via NOT EXISTS); {retry_condition} optionally re-includes ERROR rows,
+# {one_file_condition} optionally drops assets already fingerprinted under any file key
+ARTLIST_ASSETS_QUERY = """
+    WITH base AS (
+      SELECT
+        da.asset_id::string as asset_id,
+        sf.filekey AS file_key,
+        CASE WHEN sf.role = 'CORE' THEN 'wav' ELSE LOWER(sf.role) END AS file_format,
+        0 as file_size,
+        'artlist' as source,
+        sf.createdat as created_at
+      FROM BI_PROD.dwh.DIM_ASSETS da
+      JOIN ODS_PROD.cross_products_ods.POSTGRES_ASM_ASSET a
+        ON da.asset_id::string = a.externalid::int::string
+      JOIN ODS_PROD.cross_products_ods.POSTGRES_ASM_songFILE sf
+        ON a.id = sf.songid
+      WHERE da.product_indicator = 1
+        AND da.asset_type = 'Music'
+        AND sf.role IN ('CORE', 'MP3')
+        AND NOT EXISTS (  -- Unprocessed (or errors, when retrying)
+          SELECT 1 FROM AI_DATA.AUDIO_FINGERPRINT af
+          WHERE af.asset_id = da.asset_id::string AND af.file_key = sf.filekey {retry_condition}
+        )
+        {one_file_condition}
+    ),
+    deduplicated AS (
+      SELECT asset_id, file_key, file_format, file_size, source
+      FROM (
+        SELECT
+          asset_id, file_key, file_format, file_size, source, created_at,
+          ROW_NUMBER() OVER (
+            PARTITION BY asset_id, file_format
+            ORDER BY created_at DESC, file_key
+          ) AS rn
+        FROM base
+      )
+      WHERE rn = 1
+    )
+    SELECT asset_id, file_key, file_format, file_size, source
+    FROM deduplicated
+    ORDER BY asset_id
+    """
+
+MOTIONARRAY_ASSETS_QUERY = """
+    WITH base AS (
+      SELECT
+        a.asset_id::string as asset_id,
+        b.guid AS file_key,
+        CASE
+          WHEN pf.format_id = 1 THEN 'wav'
+          WHEN pf.format_id = 2 THEN 'mp3'
+          WHEN pf.format_id = 3 THEN 'aiff'
+          ELSE 'mp3'
+        END AS file_format,
+        0 as file_size,
+        'motionarray' as source,
+        c.created_at
+      FROM BI_PROD.dwh.DIM_ASSETS a
+      JOIN ODS_PROD.motion_array_ods.MYSQL_PRODUCT_CMS_RESOLUTIONS b
+        ON a.asset_id::string = b.product_id::string
+      JOIN ODS_PROD.motion_array_ods.MYSQL_PRODUCT_CMS_AUDIO_RESOLUTIONS c
+        ON b.id = c.parent_id
+      LEFT JOIN ODS_PROD.motion_array_ods.MYSQL_PRODUCT_FORMAT pf
+        ON pf.product_id = a.asset_id
+      WHERE a.product_indicator = 3
+        AND a.asset_sub_type ILIKE '%music%'
+        AND b.resolution_format = 1
+        AND NOT EXISTS (  -- Unprocessed (or errors, when retrying)
+          SELECT 1 FROM AI_DATA.AUDIO_FINGERPRINT af
+          WHERE af.asset_id = a.asset_id::string AND af.file_key = b.guid {retry_condition}
+        )
+        {one_file_condition}
+    ),
+    deduplicated AS (
+      SELECT asset_id, file_key, file_format, file_size, source
+      FROM (
+        SELECT
+          asset_id, file_key, file_format, file_size, source, created_at,
+          ROW_NUMBER() OVER (
+            PARTITION BY asset_id, file_format
+            ORDER BY created_at DESC, file_key
+          ) AS rn
+        FROM base
+      )
+      WHERE rn = 1
+    )
+    SELECT asset_id, file_key, file_format, file_size, source
+    FROM deduplicated
+    ORDER BY asset_id
+    """
+
+RETRY_ERRORS_CONDITION = "AND af.processing_status IS DISTINCT FROM 'ERROR'"
+# --one-file-per-asset: the per-key anti-join alone would return the other format of an asset
+# fingerprinted on an earlier run; {asset_id} is the source's asset ID column
+ONE_FILE_PER_ASSET_CONDITION = """AND NOT EXISTS (
+          SELECT 1 FROM AI_DATA.AUDIO_FINGERPRINT done
+          WHERE done.asset_id = {asset_id}::string AND done.processing_status = 'SUCCESS'
+        )"""
+
+# Signed-URL endpoint; accepts many keys per request and returns a map keyed by file key
+DOWNLOAD_API_URL = "https://oapi-int.artlist.io/v1/content/bulkDownloadArtifacts"
+DOWNLOAD_API_HEADERS = {
+    'service-host': 'core.content.cms.api',
+    'Content-Type': 'application/json'
+}
+
+# Seconds of audio fingerprinted per file; large enough to cover the whole track.
+# Stored fingerprints are compared by exact match, so changing this invalidates comparisons.
+FINGERPRINT_MAX_LENGTH = 10000
+
+# Upper-bound byte rate used to cut off downloads when max_length is capped (320 kbps MP3),
+# plus room for container headers; a leading ID3v2 tag (cover art) is sized from its own header
+RANGE_BYTES_PER_SECOND = {'mp3': 40_000}
+RANGE_HEADER_ALLOWANCE = 256 * 1024
+# PCM byte rates depend on bit depth, sample rate and channels (24-bit/96 kHz stereo is 3x
+# 16-bit/48 kHz), so these are sized from the fmt/COMM chunk of the first downloaded chunk
+PCM_FORMATS = {'wav', 'aiff'}
+
+# Connection pool size for the shared HTTP session
+HTTP_POOL_SIZE = 32
+
+# Large S3 objects are downloaded as RANGE_PART_SIZE parts, RANGE_PARALLELISM at a time per file
+RANGE_PART_SIZE = 8 * 1024 * 1024
+RANGE_PARALLELISM = 8
+
+# Downloads are written to tmpfs instead of disk when it has at least this much free space
+RAM_SCRATCH_DIR = '/dev/shm'
+RAM_SCRATCH_MIN_FREE = 4 * 1024 ** 3
+
+# Read size for downloads (to disk or into fpcalc); large reads keep the per-chunk
+# Python overhead negligible. FPCALC_TIMEOUT bounds fpcalc per file.
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+FPCALC_TIMEOUT = 300
+
+# Number of file keys resolved per bulkDownloadArtifacts call (also the prefetch chunk while submitting work)
+URL_PREFETCH_SIZE = 100
+
+# Batches smaller than this are written with a multi-row INSERT; PUT + COPY has a
+# fixed per-file cost that only pays off for larger batches
+STAGED_LOAD_MIN_ROWS = 1000
+
+# Buffered record fields written to AUDIO_FINGERPRINT by the staged bulk load
+# (CREATED_AT / UPDATED_AT are left to their column defaults)
+STAGED_COLUMNS = {
+    'asset_id': 'string',
+    'file_key': 'string',
+    'format': 'string',
+    'duration': 'float64',
+    'fingerprint': 'string',
+    'file_size': 'Int64',
+    'source': 'string',
+    'error_message': 'string',
+    'processing_status': 'string',
+}
+
+# Format ranking for --one-file-per-asset (lower wins; unlisted formats rank last)
+FORMAT_PREFERENCE = {'wav': 0, 'mp3': 1}
+
+def _one_file_per_asset(assets: List[Asset]) -> List[Asset]:
+    """Keep a single file key per asset, preferring WAV over MP3 over anything else"""
+    best: Dict[str, Asset] = {}
+    for asset in assets:
+        kept = best.get(asset.ASSET_ID)
+        if kept is None or (FORMAT_PREFERENCE.get(asset.FILE_FORMAT, 9) <
+                            FORMAT_PREFERENCE.get(kept.FILE_FORMAT, 9)):
+            best[asset.ASSET_ID] = asset
+    return list(best.values())
+
+def _merge_sql(source_sql: str) -> str:
+    """MERGE buffered rows (selected by source_sql with STAGED_COLUMNS names) into AUDIO_FINGERPRINT.
+    New keys are inserted and stored ERROR rows are overwritten; SUCCESS rows are never duplicated or replaced."""
+    columns = list(STAGED_COLUMNS)
+    return f"""
+    MERGE INTO AI_DATA.AUDIO_FINGERPRINT t
+    USING ({source_sql}) s
+    ON t.ASSET_ID = s.asset_id AND t.FILE_KEY = s.file_key
+    WHEN MATCHED AND t.PROCESSING_STATUS = 'ERROR' THEN UPDATE SET
+      {", ".join(f"{column.upper()} = s.{column}" for column in columns[2:])}, UPDATED_AT = CURRENT_TIMESTAMP()
+    WHEN NOT MATCHED THEN INSERT ({", ".join(column.upper() for column in columns)})
+      VALUES ({", ".join(f"s.{column}" for column in columns)})
+    """
+
+def _chunked(items, size: int):
+    """Yield successive lists of at most `size` items"""
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+def _fetch_assets_arrow(cursor) -> List[Asset]:
+    """Fetch an asset result set chunk by chunk as Arrow tables and build Asset rows column-wise
+    
+    Falls back to fetchmany when the Arrow fetch is unavailable, so a missing extra never reads as an empty result.
+    """
+    try:
+        batches = iter(cursor.fetch_arrow_batches())
+        first = next(batches, None)
+    except Exception as e:
+        # pyarrow missing or mismatched (connector installed without its [pandas] extra), or a non-Arrow result
+        logger.warning(f"⚠️  Arrow fetch unavailable, falling back to fetchmany: {e}")
+        return _fetch_assets_rows(cursor)
+    
+    assets = []
+    # Only one result chunk is held in Arrow form at a time (no full raw-row copy next to the Assets)
+    for table in chain([first] if first is not None else [], batches):
+        # to_pylist converts each column in C; zip re-assembles rows without a per-row dict
+        assets.extend(map(Asset._make, zip(*(column.to_pylist() for column in table.columns))))
+    return assets
+
+def _fetch_assets_rows(cursor) -> List[Asset]:
+    """Fetch an asset result set FETCH_BATCH_SIZE rows at a time"""
+    assets = []
+    while True:
+        rows = cursor.fetchmany(FETCH_BATCH_SIZE)
+        if not rows:
+            return assets
+        assets.extend(map(Asset._make, rows))
+
+def _pcm_byte_rate(head: bytes) -> Optional[int]:
+    """Bytes per second of a WAV (fmt chunk) or AIFF/AIFC (COMM chunk) from its leading bytes, or None"""
+    if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+        endian, wanted = '<', b'fmt '
+    elif head[:4] == b'FORM' and head[8:12] in (b'AIFF', b'AIFC'):
+        endian, wanted = '>', b'COMM'
+    else:
+        return None
+    pos = 12
+    while pos + 8 <= len(head):
+        chunk_id, size = struct.unpack_from(endian + '4sI', head, pos)
+        body = pos + 8
+        if chunk_id == wanted:
+            if endian == '<':
+                if body + 16 > len(head):
+                    return None
+                channels, sample_rate, avg_bytes, block_align, bits = struct.unpack_from('<HIIHH', head, body + 2)
+                rate = max(avg_bytes, block_align * sample_rate, channels * sample_rate * ((bits + 7) // 8))
+            else:
+                if body + 18 > len(head):
+                    return None
+                # Sample rate is an 80-bit IEEE extended float
+                channels, _, bits, exponent, mantissa = struct.unpack_from('>HIHHQ', head, body)
+                sample_rate = mantissa * 2.0 ** ((exponent & 0x7FFF) - 16383 - 63)
+                rate = int(channels * ((bits + 7) // 8) * sample_rate)
+            return rate or None
+        pos = body + size + (size & 1)  # Chunks are padded to an even size
+    return None
+
+def _id3v2_size(head: bytes) -> int:
+    """Size of a leading ID3v2 tag (header, body and optional footer) from its 10-byte header, else 0"""
+    if len(head) < 10 or head[:3] != b'ID3':
+        return 0
+    size = 0
+    for byte in head[6:10]:  # Syncsafe integer: 7 bits per byte
+        size = (size << 7) | (byte & 0x7F)
+    return 10 + size + (10 if head[5] & 0x10 else 0)
+
+def _is_s3_url(url: str) -> bool:
+    """True for S3 signed URLs (path- or virtual-hosted-style), which support parallel Range GETs"""
+    host = urlparse(url).hostname or ''
+    return host.endswith('.amazonaws.com') and ('.s3.' in host or '.s3-' in host or
+                                                host.startswith(('s3.', 's3-')))
+
+def _content_range_total(response) -> Optional[int]:
+    """Total object size from a 206 response's Content-Range header ('bytes 0-99/1234')"""
+    if response.status_code != 206:
+        return None
+    total = response.headers.get('Content-Range', '').rpartition('/')[2]
+    return int(total) if total.isdigit() else None
+
+def _object_size(response) -> Optional[int]:
+    """Full object size from Content-Range (206) or Content-Length (200), even when only a prefix is read"""
+    total = _content_range_total(response)
+    if total is None and response.status_code == 200:
+        length = response.headers.get('Content-Length', '')
+        total = int(length) if length.isdigit() else None
+    return total
+
+def _writable_dir(path: str) -> bool:
+    """True if path is an existing directory this process can create files in"""
+    return os.path.isdir(path) and os.access(path, os.W_OK | os.X_OK)
+
+def _ram_scratch_dir() -> Optional[str]:
+    """Return /dev/shm if it is a usable tmpfs with enough free space, else None (system temp dir)"""
+    if SYSTEM != 'Linux' or not os.path.isdir(RAM_SCRATCH_DIR):
+        return None
+    try:
+        if shutil.disk_usage(RAM_SCRATCH_DIR).free < RAM_SCRATCH_MIN_FREE:
+            return None  # e.g. Docker's default 64 MB /dev/shm
+    except OSError:
+        return None
+    logger.info(f"🧠 Using RAM-backed temp directory: {RAM_SCRATCH_DIR}")
+    return RAM_SCRATCH_DIR
+
+@lru_cache(maxsize=1)
+def _load_chromaprint():
+    """Load libchromaprint and configure acoustid/fpcalc once per process (cross-platform)"""
+    try:
+        # Platform-specific library loading
+        chromaprint_lib = None
+        if SYSTEM == 'Darwin':  # macOS
+            lib_paths = [
+                '/opt/homebrew/lib/libchromaprint.dylib',
+                '/usr/local/lib/libchromaprint.dylib'
+            ]
+            for lib_path in lib_paths:
+                if os.path.exists(lib_path):
+                    chromaprint_lib = ctypes.CDLL(lib_path)
+                    logger.info(f"✅ Loaded chromaprint library from: {lib_path}")
+                    break
+        elif SYSTEM == 'Linux':
+            lib_paths = [
+                'libchromaprint.so.1',  # Try system library first
+                'libchromaprint.so',
+                '/lib/x86_64-linux-gnu/libchromaprint.so.1',
+                '/lib/x86_64-linux-gnu/libchromaprint.so',
+                '/usr/lib/x86_64-linux-gnu/libchromaprint.so.1',
+                '/usr/lib/libchromaprint.so.1',
+                '/usr/local/lib/libchromaprint.so.1'
+            ]
+            for lib_path in lib_paths:
+                try:
+                    chromaprint_lib = ctypes.CDLL(lib_path)
+                    logger.info(f"✅ Loaded chromaprint library: {lib_path}")
+                    break
+                except OSError:
+                    continue
+        
+        if not chromaprint_lib:
+            raise RuntimeError(f"Could not find chromaprint library for {SYSTEM}")
+        
+        # Import acoustid after library is loaded
+        import acoustid
+        
+        # Find fpcalc binary
+        fpcalc_path = shutil.which('fpcalc')
+        if not fpcalc_path:
+            # Try platform-specific paths
+            if SYSTEM == 'Darwin':
+                candidate_paths = ['/opt/homebrew/bin/fpcalc', '/usr/local/bin/fpcalc']
+            else:  # Linux
+                candidate_paths = ['/usr/bin/fpcalc', '/usr/local/bin/fpcalc']
+            
+            for path in candidate_paths:
+                if os.path.exists(path):
+                    fpcalc_path = path
+                    break
+        
+        if not fpcalc_path:
+            if SYSTEM == 'Linux':
+                raise RuntimeError(
+                    f"Could not find fpcalc binary. Please install it:\n"
+                    f"  Ubuntu/Debian: sudo apt-get install libchromaprint-tools\n"
+                    f"  Fedora/RHEL: sudo dnf install chromaprint-tools\n"
+                    f"  Arch: sudo pacman -S chromaprint"
+                )
+            else:
+                raise RuntimeError(
+                    f"Could not find fpcalc binary. Please install it:\n"
+                    f"  macOS: brew install chromaprint"
+                )
+        
+        os.environ['FPCALC_COMMAND'] = fpcalc_path
+        acoustid.FPCALC_COMMAND = fpcalc_path
+        
+        if SYSTEM == 'Darwin' and not acoustid.have_chromaprint:
+            logger.warning("⚠️  pyacoustid could not load libchromaprint (DYLD_LIBRARY_PATH not set?); "
+                           "fingerprints will be computed through fpcalc. Run via bin/run_fingerprinter.sh "
+                           "to use the library")
+        
+        logger.info(f"✅ Chromaprint setup successful on {SYSTEM} (fpcalc: {fpcalc_path})")
+        return acoustid
+    except Exception as e:
+        logger.error(f"❌ Chromaprint setup failed on {SYSTEM}: {e}")
+        raise
+
+def default_max_workers() -> int:
+    """Default worker count for the mixed I/O (download) + CPU (fpcalc) workload"""
+    return min(32, (os.cpu_count() or 1) * 2)
+
+def _positive_int(value: str) -> int:
+    """argparse type for counts that must be at least 1"""
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"must be a positive integer, got {value}")
+    return number
+
 class AudioFingerprintProcessor:
     """Processor with parallel processing and source filtering"""
     
-    def __init__(self, max_workers: int = 4, batch_size: int = 5000):
+    def __init__(self, max_workers: int = 4, batch_size: int = 5000, stream_to_fpcalc: bool = False,
+                 max_length: int = FINGERPRINT_MAX_LENGTH, scratch_dir: Optional[str] = None):
         self.snowflake = SnowflakeConnector()
         self.acoustid = self.setup_chromaprint()
         self.max_workers = max_workers
+        self.stream_to_fpcalc = stream_to_fpcalc  # Pipe downloads into fpcalc instead of temp files
+        self.max_length = max_length  # Seconds of audio decoded per file (bounds fpcalc CPU)
         self.batch_size = batch_size
         self.temp_dirs = {}  # Thread-safe temp directory management
+        # Explicit dir (--tmpdir / FP_TMPDIR, e.g. a macOS RAM disk), else /dev/shm when usable, else system default
+        self.scratch_dir = scratch_dir or os.environ.get('FP_TMPDIR') or _ram_scratch_dir()
+        if self.scratch_dir and not _writable_dir(self.scratch_dir):
+            # Checked once here; otherwise every worker's mkdtemp fails and each asset is stored as an ERROR row
+            raise ValueError(f"Scratch directory is not a writable directory: {self.scratch_dir}")
         self.thread_local = local()  # Thread-local storage for connections
         self.stats_lock = Lock()
         self.stats = {
@@ -64,86 +464,67 @@ class AudioFingerprintProcessor:
             'failed': 0,
             'start_time': None
         }
-        # Batch writing buffers (thread-safe)
+        # Downloads run on all max_workers threads; fpcalc (CPU-bound, separate process)
+        # is capped at one concurrent decode per core
+        self.fingerprint_slots = threading.BoundedSemaphore(os.cpu_count() or 1)
+        self._url_cache = {}  # file_key -> signed URL, filled in bulk ahead of the workers
+        # One pooled HTTP session for API calls and downloads (keep-alive across assets);
+        # pool sized for every worker running its own Range GETs at once
+        self.http = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=HTTP_POOL_SIZE,
+            pool_maxsize=max(HTTP_POOL_SIZE, max_workers * RANGE_PARALLELISM),
+            # Also retry throttling/5xx answers (S3 SlowDown, gateway errors); the bulk URL POST is read-only
+            max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=(429, 500, 502, 503, 504),
+                              allowed_methods=frozenset({'GET', 'POST'}))
+        )
+        self.http.mount('https://', adapter)
+        self.http.mount('http://', adapter)
+        # Batch writing buffer shared by SUCCESS and ERROR rows (thread-safe)
         self.batch_lock = Lock()
-        self.fingerprint_batch = []
-        self.error_batch = []
+        self.record_batch = []
+        # Source queries specialized once per (source, retry_errors, one_file_per_asset) combination
+        self._source_sql = {
+            (source, retry_errors, one_file): template.format(
+                retry_condition=RETRY_ERRORS_CONDITION if retry_errors else "",
+                one_file_condition=ONE_FILE_PER_ASSET_CONDITION.format(asset_id=asset_id) if one_file else ""
+            )
+            for source, template, asset_id in (('artlist', ARTLIST_ASSETS_QUERY, 'da.asset_id'),
+                                               ('motionarray', MOTIONARRAY_ASSETS_QUERY, 'a.asset_id'))
+            for retry_errors in (True, False)
+            for one_file in (True, False)
+        }
         
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    def close(self):
+        """Close this thread's reusable cursor and the main Snowflake connection"""
+        cursor = getattr(self.thread_local, 'cursor', None)
+        if cursor is not None:
+            cursor.close()
+            del self.thread_local.cursor
+        self.snowflake.close()
+        self.http.close()
+    
+    def _exec(self, sql: str, params: Dict = None):
+        """Execute on a cursor reused across calls (one per thread - cursors are not thread-safe)"""
+        cursor = getattr(self.thread_local, 'cursor', None)
+        if cursor is None or cursor.is_closed():
+            cursor = self.thread_local.cursor = self.snowflake._get_connection().cursor()
+        
+        if params:
+            cursor.execute(sql, params)
+        else:
+            cursor.execute(sql)
+        return cursor
+    
     def setup_chromaprint(self):
-        """Set up Chromaprint library and environment (cross-platform)"""
-        try:
-            # Platform-specific library loading
-            chromaprint_lib = None
-            if SYSTEM == 'Darwin':  # macOS
-                lib_paths = [
-                    '/opt/homebrew/lib/libchromaprint.dylib',
-                    '/usr/local/lib/libchromaprint.dylib'
-                ]
-                for lib_path in lib_paths:
-                    if os.path.exists(lib_path):
-                        chromaprint_lib = ctypes.CDLL(lib_path)
-                        logger.info(f"✅ Loaded chromaprint library from: {lib_path}")
-                        break
-            elif SYSTEM == 'Linux':
-                lib_paths = [
-                    'libchromaprint.so.1',  # Try system library first
-                    'libchromaprint.so',
-                    '/lib/x86_64-linux-gnu/libchromaprint.so.1',
-                    '/lib/x86_64-linux-gnu/libchromaprint.so',
-                    '/usr/lib/x86_64-linux-gnu/libchromaprint.so.1',
-                    '/usr/lib/libchromaprint.so.1',
-                    '/usr/local/lib/libchromaprint.so.1'
-                ]
-                for lib_path in lib_paths:
-                    try:
-                        chromaprint_lib = ctypes.CDLL(lib_path)
-                        logger.info(f"✅ Loaded chromaprint library: {lib_path}")
-                        break
-                    except OSError:
-                        continue
-            
-            if not chromaprint_lib:
-                raise RuntimeError(f"Could not find chromaprint library for {SYSTEM}")
-            
-            # Import acoustid after library is loaded
-            import acoustid
-            
-            # Find fpcalc binary
-            fpcalc_path = shutil.which('fpcalc')
-            if not fpcalc_path:
-                # Try platform-specific paths
-                if SYSTEM == 'Darwin':
-                    candidate_paths = ['/opt/homebrew/bin/fpcalc', '/usr/local/bin/fpcalc']
-                else:  # Linux
-                    candidate_paths = ['/usr/bin/fpcalc', '/usr/local/bin/fpcalc']
-                
-                for path in candidate_paths:
-                    if os.path.exists(path):
-                        fpcalc_path = path
-                        break
-            
-            if not fpcalc_path:
-                if SYSTEM == 'Linux':
-                    raise RuntimeError(
-                        f"Could not find fpcalc binary. Please install it:\n"
-                        f"  Ubuntu/Debian: sudo apt-get install libchromaprint-tools\n"
-                        f"  Fedora/RHEL: sudo dnf install chromaprint-tools\n"
-                        f"  Arch: sudo pacman -S chromaprint"
-                    )
-                else:
-                    raise RuntimeError(
-                        f"Could not find fpcalc binary. Please install it:\n"
-                        f"  macOS: brew install chromaprint"
-                    )
-            
-            os.environ['FPCALC_COMMAND'] = fpcalc_path
-            acoustid.FPCALC_COMMAND = fpcalc_path
-            
-            logger.info(f"✅ Chromaprint setup successful on {SYSTEM} (fpcalc: {fpcalc_path})")
-            return acoustid
-        except Exception as e:
-            logger.error(f"❌ Chromaprint setup failed on {SYSTEM}: {e}")
-            raise
+        """Set up Chromaprint library and environment (cross-platform); loaded once per process"""
+        return _load_chromaprint()
     
     def ensure_table_exists(self):
         """Create AUDIO_FINGERPRINT table if it doesn't exist"""
@@ -162,140 +543,61 @@ class AudioFingerprintProcessor:
             UPDATED_AT TIMESTAMP DEFAULT CURRENT_TIMESTAMP(),
             PRIMARY KEY (ASSET_ID, FILE_KEY)
         )
+        CLUSTER BY (ASSET_ID)
         """
         
         try:
-            self.snowflake.execute_query(create_table_sql)
+            self._exec(create_table_sql)
             logger.info("✅ AUDIO_FINGERPRINT table ready")
         except Exception as e:
             logger.error(f"❌ Failed to create table: {e}")
             raise
     
-    def get_all_assets_by_source(self, source: str, retry_errors: bool = False) -> List[Dict]:
+    def get_all_assets_by_source(self, source: str, retry_errors: bool = False,
+                                 one_file_per_asset: bool = False) -> List[Asset]:
         """
         Get ALL assets from a specific source (artlist or motionarray)
         
         Args:
             source: 'artlist' or 'motionarray'
             retry_errors: If True, include assets with ERROR status for reprocessing
+            one_file_per_asset: If True, leave out assets that already have a SUCCESS row for any file key
         """
-        if source.lower() == 'artlist':
-            query = """
-            WITH base AS (
-              SELECT
-                da.asset_id::string as asset_id,
-                sf.filekey AS file_key,
-                CASE WHEN sf.role = 'CORE' THEN 'wav' ELSE LOWER(sf.role) END AS file_format,
-                0 as file_size,
-                'artlist' as source,
-                sf.createdat as created_at
-              FROM BI_PROD.dwh.DIM_ASSETS da
-              JOIN ODS_PROD.cross_products_ods.POSTGRES_ASM_ASSET a
-                ON da.asset_id::string = a.externalid::int::string
-              JOIN ODS_PROD.cross_products_ods.POSTGRES_ASM_songFILE sf
-                ON a.id = sf.songid
-              LEFT JOIN AI_DATA.AUDIO_FINGERPRINT af 
-                ON da.asset_id::string = af.asset_id AND sf.filekey = af.file_key
-              WHERE da.product_indicator = 1
-                AND da.asset_type = 'Music'
-                AND sf.role IN ('CORE', 'MP3')
-                AND (af.asset_id IS NULL {retry_condition})  -- Unprocessed or errors
-            ),
-            deduplicated AS (
-              SELECT asset_id, file_key, file_format, file_size, source
-              FROM (
-                SELECT
-                  asset_id, file_key, file_format, file_size, source, created_at,
-                  ROW_NUMBER() OVER (
-                    PARTITION BY asset_id, file_format
-                    ORDER BY created_at DESC, file_key
-                  ) AS rn
-                FROM base
-              )
-              WHERE rn = 1
-            )
-            SELECT asset_id, file_key, file_format, file_size, source
-            FROM deduplicated
-            ORDER BY asset_id
-            """
-            retry_condition = "OR af.processing_status = 'ERROR'" if retry_errors else ""
-            query = query.format(retry_condition=retry_condition)
-            
-        elif source.lower() == 'motionarray':
-            query = """
-            WITH base AS (
-              SELECT
-                a.asset_id::string as asset_id,
-                b.guid AS file_key,
-                CASE
-                  WHEN pf.format_id = 1 THEN 'wav'
-                  WHEN pf.format_id = 2 THEN 'mp3'
-                  WHEN pf.format_id = 3 THEN 'aiff'
-                  ELSE 'mp3'
-                END AS file_format,
-                0 as file_size,
-                'motionarray' as source,
-                c.created_at
-              FROM BI_PROD.dwh.DIM_ASSETS a
-              JOIN ODS_PROD.motion_array_ods.MYSQL_PRODUCT_CMS_RESOLUTIONS b
-                ON a.asset_id::string = b.product_id::string
-              JOIN ODS_PROD.motion_array_ods.MYSQL_PRODUCT_CMS_AUDIO_RESOLUTIONS c
-                ON b.id = c.parent_id
-              LEFT JOIN ODS_PROD.motion_array_ods.MYSQL_PRODUCT_FORMAT pf
-                ON pf.product_id = a.asset_id
-              LEFT JOIN AI_DATA.AUDIO_FINGERPRINT af 
-                ON a.asset_id::string = af.asset_id AND b.guid = af.file_key
-              WHERE a.product_indicator = 3
-                AND a.asset_sub_type ILIKE '%music%'
-                AND b.resolution_format = 1
-                AND (af.asset_id IS NULL {retry_condition})  -- Unprocessed or errors
-            ),
-            deduplicated AS (
-              SELECT asset_id, file_key, file_format, file_size, source
-              FROM (
-                SELECT
-                  asset_id, file_key, file_format, file_size, source, created_at,
-                  ROW_NUMBER() OVER (
-                    PARTITION BY asset_id, file_format
-                    ORDER BY created_at DESC, file_key
-                  ) AS rn
-                FROM base
-              )
-              WHERE rn = 1
-            )
-            SELECT asset_id, file_key, file_format, file_size, source
-            FROM deduplicated
-            ORDER BY asset_id
-            """
-            retry_condition = "OR af.processing_status = 'ERROR'" if retry_errors else ""
-            query = query.format(retry_condition=retry_condition)
-        else:
+        query = self._source_sql.get((source.lower(), bool(retry_errors), bool(one_file_per_asset)))
+        if query is None:
             raise ValueError(f"Invalid source: {source}. Must be 'artlist' or 'motionarray'")
         
         try:
-            cursor = self.snowflake.execute_query(query)
-            results = cursor.fetchall()
+            cursor = self._exec(query)
+            assets = _fetch_assets_arrow(cursor)
             
-            if results:
-                columns = [desc[0] for desc in cursor.description]
-                assets = [dict(zip(columns, row)) for row in results]
+            if assets:
                 logger.info(f"📊 Found {len(assets)} unprocessed {source} assets")
                 return assets
             else:
                 logger.warning(f"⚠️  No unprocessed {source} assets found")
                 return []
         except Exception as e:
+            # Re-raised: an empty list would read as "nothing left to process" and exit 0
             logger.error(f"❌ Failed to get {source} assets: {e}")
-            return []
+            raise
     
-    def get_asset_file_keys(self, asset_ids: List[str] = None) -> List[Dict]:
-        """Get specific asset file keys (original method for compatibility)"""
+    def get_asset_file_keys(self, asset_ids: List[str] = None, skip_existing: bool = True,
+                            retry_errors: bool = False, one_file_per_asset: bool = False) -> List[Asset]:
+        """
+        Get specific asset file keys (original method for compatibility)
+        
+        Args:
+            asset_ids: Asset IDs to look up
+            skip_existing: If True, drop file keys that already have an AUDIO_FINGERPRINT row
+            retry_errors: If True (with skip_existing), keep file keys whose row has ERROR status
+            one_file_per_asset: If True, drop assets that already have a SUCCESS row for any file key
+        """
         if not asset_ids:
             return []
             
-        asset_filter = "', '".join(asset_ids)
-        
-        query = f"""
+        # Pass the IDs as one JSON-array parameter so the connector quotes them (no hand-built IN list, no injection)
+        query = """
         WITH artlist_base AS (
           SELECT
             da.asset_id::string as asset_id,
@@ -311,7 +613,7 @@ class AudioFingerprintProcessor:
           WHERE da.product_indicator = 1
             AND da.asset_type = 'Music'
             AND sf.role IN ('CORE', 'MP3')
-            AND da.asset_id::string IN ('{asset_filter}')
+            AND da.asset_id::string IN (SELECT VALUE::string FROM TABLE(FLATTEN(INPUT => PARSE_JSON(%(ids)s))))
         ),
         motionarray_base AS (
           SELECT
@@ -333,9 +635,9 @@ class AudioFingerprintProcessor:
           LEFT JOIN ODS_PROD.motion_array_ods.MYSQL_PRODUCT_FORMAT pf
             ON pf.product_id = a.asset_id
           WHERE a.product_indicator = 3
-            AND a.asset_sub_type ILIKE '%music%'
+            AND a.asset_sub_type ILIKE '%%music%%'
             AND b.resolution_format = 1
-            AND a.asset_id::string IN ('{asset_filter}')
+            AND a.asset_id::string IN (SELECT VALUE::string FROM TABLE(FLATTEN(INPUT => PARSE_JSON(%(ids)s))))
         )
         SELECT * FROM artlist_base
         UNION ALL
@@ -343,32 +645,62 @@ class AudioFingerprintProcessor:
         """
         
         try:
-            cursor = self.snowflake.execute_query(query)
-            results = cursor.fetchall()
-            
-            if results:
-                columns = [desc[0] for desc in cursor.description]
-                return [dict(zip(columns, row)) for row in results]
-            else:
+            cursor = self._exec(query, {'ids': json.dumps(list(asset_ids))})
+            assets = _fetch_assets_arrow(cursor)
+            if not assets:
                 return []
         except Exception as e:
             logger.error(f"❌ Failed to get asset file keys: {e}")
-            return []
+            raise
+        
+        if skip_existing:
+            total_found = len(assets)
+            existing = self.get_existing_file_keys(asset_ids, include_errors=not retry_errors)
+            if existing:
+                assets = [a for a in assets if (a.ASSET_ID, a.FILE_KEY) not in existing]
+                logger.info(f"⏭️  Skipping {total_found - len(assets)} already-processed file keys")
+        if one_file_per_asset:
+            fingerprinted = self.get_fingerprinted_asset_ids(asset_ids)
+            if fingerprinted:
+                assets = [a for a in assets if a.ASSET_ID not in fingerprinted]
+                logger.info(f"⏭️  Skipping {len(fingerprinted)} already-fingerprinted assets")
+        return assets
+    
+    def get_existing_file_keys(self, asset_ids: List[str], include_errors: bool = True) -> Set[Tuple[str, str]]:
+        """Get (ASSET_ID, FILE_KEY) pairs already stored for the given assets, in one query"""
+        status_filter = "" if include_errors else "AND PROCESSING_STATUS <> 'ERROR'"
+        # IDs are passed as a JSON-array parameter for safe quoting, as in get_asset_file_keys
+        query = f"""
+        SELECT ASSET_ID, FILE_KEY
+        FROM AI_DATA.AUDIO_FINGERPRINT
+        WHERE ASSET_ID IN (SELECT VALUE::string FROM TABLE(FLATTEN(INPUT => PARSE_JSON(%(ids)s)))) {status_filter}
+        """
+        
+        try:
+            cursor = self._exec(query, {'ids': json.dumps(list(asset_ids))})
+            return {(asset_id, file_key) for asset_id, file_key in cursor.fetchall()}
+        except Exception as e:
+            logger.warning(f"⚠️  Failed to check existing file keys, processing all: {e}")
+            return set()
+    
+    def get_fingerprinted_asset_ids(self, asset_ids: List[str]) -> Set[str]:
+        """Get which of the given assets have at least one SUCCESS row, whatever the file key"""
+        query = """
+        SELECT DISTINCT ASSET_ID
+        FROM AI_DATA.AUDIO_FINGERPRINT
+        WHERE ASSET_ID IN (SELECT VALUE::string FROM TABLE(FLATTEN(INPUT => PARSE_JSON(%(ids)s))))
+          AND PROCESSING_STATUS = 'SUCCESS'
+        """
+        cursor = self._exec(query, {'ids': json.dumps(list(asset_ids))})
+        return {asset_id for asset_id, in cursor.fetchall()}
     
     def get_thread_temp_dir(self) -> Path:
         """Get thread-specific temporary directory"""
         thread_id = threading.current_thread().ident
         if thread_id not in self.temp_dirs:
-            self.temp_dirs[thread_id] = tempfile.mkdtemp(prefix=f"audio_fp_thread_{thread_id}_")
+            self.temp_dirs[thread_id] = tempfile.mkdtemp(prefix=f"audio_fp_thread_{thread_id}_", dir=self.scratch_dir)
         return Path(self.temp_dirs[thread_id])
     
-    def get_thread_snowflake(self) -> SnowflakeConnector:
-        """Get or create thread-local Snowflake connection"""
-        if not hasattr(self.thread_local, 'snowflake'):
-            self.thread_local.snowflake = SnowflakeConnector()
-            logger.info(f"🔗 [{threading.current_thread().name}] Created thread-local Snowflake connection")
-        return self.thread_local.snowflake
-    
     def cleanup_thread_temp_dir(self):
         """Clean up thread-specific temporary directory"""
         thread_id = threading.current_thread().ident
@@ -379,56 +711,85 @@ class AudioFingerprintProcessor:
             except Exception as e:
                 logger.warning(f"⚠️  Failed to cleanup temp dir for thread {thread_id}: {e}")
     
-    def cleanup_thread_connection(self):
-        """Clean up thread-local Snowflake connection"""
-        if hasattr(self.thread_local, 'snowflake'):
-            try:
-                self.thread_local.snowflake.close()
-                delattr(self.thread_local, 'snowflake')
-                logger.info(f"🔌 [{threading.current_thread().name}] Closed thread-local Snowflake connection")
-            except Exception as e:
-                logger.warning(f"⚠️  Failed to cleanup connection for thread: {e}")
+    def get_download_urls_from_api(self, file_keys: List[str]) -> Dict[str, str]:
+        """Get signed download URLs for many file keys, URL_PREFETCH_SIZE keys per bulkDownloadArtifacts call"""
+        urls = {}
+        # Bounded request bodies; a failed call only loses its own chunk
+        for chunk in _chunked(file_keys, URL_PREFETCH_SIZE):
+            urls.update(self._post_download_urls(chunk))
+        return urls
     
-    def get_download_url_from_api(self, file_key: str, source: str) -> Optional[str]:
-        """Get signed download URL from Artlist/MotionArray API"""
+    def _post_download_urls(self, file_keys: List[str]) -> Dict[str, str]:
+        """Resolve one chunk of file keys with a single bulkDownloadArtifacts call"""
+        if not file_keys:
+            return {}
+        
         try:
-            import requests
-            
-            api_url = "https://oapi-int.artlist.io/v1/content/bulkDownloadArtifacts"
-            headers = {
-                'service-host': 'core.content.cms.api',
-                'Content-Type': 'application/json'
-            }
-            
-            payload = {"keys": [file_key]}
-            
-            response = requests.post(
-                api_url,
-                headers=headers,
-                json=payload,
+            response = self.http.post(
+                DOWNLOAD_API_URL,
+                headers=DOWNLOAD_API_HEADERS,
+                json={"keys": list(file_keys)},
                 timeout=30
             )
             
             response.raise_for_status()
             result = response.json()
             
+            urls = {}
             if 'data' in result and 'downloadArtifactResponses' in result['data']:
                 responses = result['data']['downloadArtifactResponses']
-                for key, response in responses.items():
-                    if isinstance(response, dict) and 'url' in response:
-                        return response['url']
+                for key, artifact in responses.items():
+                    if isinstance(artifact, dict) and 'url' in artifact:
+                        urls[key] = artifact['url']
             
-            logger.warning(f"⚠️  No download URL found in API response for {file_key}")
-            return None
+            missing = len(file_keys) - len(urls)
+            if missing:
+                logger.warning(f"⚠️  No download URL in API response for {missing}/{len(file_keys)} keys")
+            return urls
             
         except Exception as e:
-            logger.warning(f"❌ API request failed for {file_key}: {e}")
-            return None
+            logger.warning(f"❌ Bulk API request failed for {len(file_keys)} keys: {e}")
+            return {}
     
-    def download_audio_file(self, file_key: str, source: str, temp_dir: Path) -> Optional[Path]:
-        """Download audio file using Artlist/MotionArray API with enhanced validation"""
+    def get_download_url_from_api(self, file_key: str, source: str) -> Optional[str]:
+        """Get signed download URL from Artlist/MotionArray API"""
+        urls = self.get_download_urls_from_api([file_key])
+        # The API keys responses by file key; fall back to the only entry if it differs
+        return urls.get(file_key) or next(iter(urls.values()), None)
+    
+    def download_byte_limit(self, file_format: Optional[str], head: bytes = b'') -> Optional[int]:
+        """Bytes needed to cover max_length seconds of audio, or None to download the whole file
+        
+        `head` is the file's leading bytes: WAV/AIFF byte rates come from its fmt/COMM chunk (None when
+        unparsable) and an MP3's ID3v2 tag size is added on top of the audio bytes.
+        """
+        if self.max_length >= FINGERPRINT_MAX_LENGTH:
+            return None  # Whole-track fingerprints need the whole file
+        file_format = (file_format or '').lower()
+        if file_format in PCM_FORMATS:
+            bytes_per_second, tag_size = _pcm_byte_rate(head), 0
+        else:
+            bytes_per_second, tag_size = RANGE_BYTES_PER_SECOND.get(file_format), _id3v2_size(head)
+        if bytes_per_second is None:
+            return None  # e.g. MP4/M4A can keep its index at the end of the file
+        return self.max_length * bytes_per_second + RANGE_HEADER_ALLOWANCE + tag_size
+    
+    def sizes_from_header(self, file_format: Optional[str]) -> bool:
+        """True when a capped download is cut off at a limit read from its first chunk"""
+        file_format = (file_format or '').lower()
+        return self.max_length < FINGERPRINT_MAX_LENGTH and (file_format in PCM_FORMATS or
+                                                              file_format in RANGE_BYTES_PER_SECOND)
+    
+    def download_audio_file(self, file_key: str, source: str, temp_dir: Path,
+                            file_format: Optional[str] = None) -> Optional[Tuple[Path, int]]:
+        """
+        Download audio file using Artlist/MotionArray API with enhanced validation
+        
+        Returns (temp_file, object_size) - the object's full size even when a capped download stops early.
+        """
         try:
-            download_url = self.get_download_url_from_api(file_key, source)
+            # Prefetched by process_assets_parallel; fall back to a single-key request
+            download_url = self._url_cache.pop(file_key, None) or self.get_download_url_from_api(file_key, source)
             if not download_url:
                 logger.warning(f"❌ No download URL obtained for {file_key}")
                 return None
@@ -439,26 +800,50 @@ class AudioFingerprintProcessor:
             
             temp_file = temp_dir / filename
             
-            import requests
-            response = requests.get(download_url, stream=True, timeout=60)
+            # With a capped max_length only the leading bytes are needed: a single GET is cut off
+            # once the first chunk's header (PCM byte rate, ID3v2 tag size) gives the limit
+            byte_limit = None
+            sized_from_header = self.sizes_from_header(file_format)
+            if sized_from_header:
+                headers = None
+            elif _is_s3_url(download_url):
+                # Fetch the first part only; the rest is pulled in parallel ranges below
+                headers = {'Range': f'bytes=0-{RANGE_PART_SIZE - 1}'}
+            else:
+                headers = None
+            
+            response = self.http.get(download_url, headers=headers, stream=True, timeout=60)
             response.raise_for_status()
+            object_size = _object_size(response)
+            total_size = _content_range_total(response) if not sized_from_header else None
             
             # Check content type if available
             content_type = response.headers.get('content-type', '').lower()
             if content_type and not any(audio_type in content_type for audio_type in ['audio', 'mpeg', 'wav', 'flac']):
                 logger.warning(f"⚠️  Unexpected content type for {file_key}: {content_type}")
             
+            head = b''  # Leading bytes kept for validation, so the file is never re-read
             with open(temp_file, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
+                written = 0
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
                     if chunk:
+                        if sized_from_header and not written:
+                            byte_limit = self.download_byte_limit(file_format, chunk)
+                        if len(head) < 1024:
+                            head += chunk[:1024 - len(head)]
                         f.write(chunk)
+                        written += len(chunk)
+                        if byte_limit and written >= byte_limit:
+                            break
+            response.close()
             
-            # Enhanced file validation
-            if not temp_file.exists():
-                logger.warning(f"❌ Downloaded file does not exist: {file_key}")
-                return None
+            file_size = written
+            if total_size and total_size > written:
+                self.download_remaining_parts(download_url, temp_file, written, total_size)
+                file_size = total_size
             
-            file_size = temp_file.stat().st_size
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"🔍 {file_key} header bytes: {head[:16].hex()}")
             
             # Check for minimum file size (1KB for audio files)
             if file_size == 0:
@@ -467,24 +852,44 @@ class AudioFingerprintProcessor:
             elif file_size < 1024:  # Less than 1KB
                 logger.warning(f"❌ Downloaded file too small ({file_size} bytes): {file_key} - likely error response")
                 # Let's check the content to see if it's an error message
-                try:
-                    with open(temp_file, 'r', encoding='utf-8', errors='ignore') as f:
-                        content = f.read(500)  # Read first 500 chars
-                    if any(error_indicator in content.lower() for error_indicator in 
-                           ['error', 'not found', 'access denied', 'forbidden', 'unauthorized', 'invalid']):
-                        logger.warning(f"❌ File contains error message: {content[:200]}")
-                except:
-                    pass  # If we can't read as text, it might be binary but still too small
+                content = head[:500].decode('utf-8', errors='ignore')
+                if any(error_indicator in content.lower() for error_indicator in 
+                       ['error', 'not found', 'access denied', 'forbidden', 'unauthorized', 'invalid']):
+                    logger.warning(f"❌ File contains error message: {content[:200]}")
                 return None
             elif file_size < 10240:  # Less than 10KB - suspicious for audio files
                 logger.warning(f"⚠️  Downloaded file suspiciously small ({file_size} bytes): {file_key}")
             
-            return temp_file
+            return temp_file, object_size or file_size
                 
         except Exception as e:
             logger.warning(f"❌ Download error: {file_key} - {e}")
             return None
     
+    def download_remaining_parts(self, url: str, file_path: Path, offset: int, total_size: int):
+        """Fetch bytes [offset, total_size) as parallel Range GETs, writing each part in place"""
+        with open(file_path, 'r+b') as f:
+            f.truncate(total_size)
+        
+        def fetch_part(start: int):
+            end = min(start + RANGE_PART_SIZE, total_size) - 1
+            # Streamed to its offset in DOWNLOAD_CHUNK_SIZE pieces, so a part is never held whole in memory
+            with self.http.get(url, headers={'Range': f'bytes={start}-{end}'}, stream=True, timeout=60) as response:
+                response.raise_for_status()
+                if response.status_code != 206:
+                    raise RuntimeError(f"Range request ignored (HTTP {response.status_code})")
+                with open(file_path, 'r+b') as f:
+                    f.seek(start)
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+        
+        starts = range(offset, total_size, RANGE_PART_SIZE)
+        # Each file gets its own bounded set of Range GETs, so concurrent large downloads never
+        # queue behind one another; list() re-raises the first part failure
+        with ThreadPoolExecutor(max_workers=min(RANGE_PARALLELISM, len(starts)),
+                                thread_name_prefix='range') as pool:
+            list(pool.map(fetch_part, starts))
+    
     def generate_fingerprint(self, file_path: Path) -> Optional[Tuple[float, str]]:
         """Generate fingerprint with robust error handling and validation"""
         try:
@@ -495,8 +900,9 @@ class AudioFingerprintProcessor:
                 return None
             
             # Attempt fingerprint generation
-            # Use maxlength=10000 to fingerprint the entire file (safe alternative to 0 which can fail)
-            duration, fingerprint = self.acoustid.fingerprint_file(str(file_path), maxlength=10000)
+            # Default max_length fingerprints the entire file (safe alternative to 0 which can fail)
+            with self.fingerprint_slots:
+                duration, fingerprint = self.acoustid.fingerprint_file(str(file_path), maxlength=self.max_length)
             
             # Validate results
             if duration is None or duration <= 0:
@@ -542,146 +948,213 @@ class AudioFingerprintProcessor:
             
             return None
     
-    def delete_existing_record(self, asset_id: str, file_key: str):
-        """Delete existing record (used when retrying errors) (thread-safe)"""
-        delete_sql = """
-        DELETE FROM AI_DATA.AUDIO_FINGERPRINT 
-        WHERE ASSET_ID = %(asset_id)s AND FILE_KEY = %(file_key)s
+    def stream_fingerprint(self, file_key: str, source: str,
+                           file_format: Optional[str] = None) -> Optional[Tuple[float, str, int]]:
+        """
+        Download and fingerprint in one pass by piping the HTTP body into `fpcalc -`
+        
+        Nothing is written to disk. Returns (duration, fingerprint, object_size) or None.
         """
+        download_url = self._url_cache.pop(file_key, None) or self.get_download_url_from_api(file_key, source)
+        if not download_url:
+            logger.warning(f"❌ No download URL obtained for {file_key}")
+            return None
+        
         try:
-            thread_snowflake = self.get_thread_snowflake()
-            cursor = thread_snowflake.execute_query(delete_sql, {
-                'asset_id': asset_id,
-                'file_key': file_key
-            })
-            cursor.close()
+            # Capped streams are cut off once the first chunk's header gives the byte limit
+            byte_limit = None
+            sized_from_header = self.sizes_from_header(file_format)
+            
+            with self.fingerprint_slots:
+                # Opened only once a decode slot is free, so waiting workers never hold an unread
+                # response (and its pooled connection) open long enough for the server to reset it
+                response = self.http.get(download_url, stream=True, timeout=60)
+                if not response.ok:
+                    response.close()
+                    response.raise_for_status()
+                response.raw.decode_content = True
+                object_size = _object_size(response)
+                
+                # stderr is discarded so fpcalc can never block on a full pipe while we feed stdin
+                proc = subprocess.Popen(
+                    [self.acoustid.FPCALC_COMMAND, '-json', '-length', str(self.max_length), '-'],
+                    stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+                )
+                bytes_streamed = 0
+                try:
+                    try:
+                        while True:
+                            chunk = response.raw.read(DOWNLOAD_CHUNK_SIZE)
+                            if not chunk:
+                                break
+                            if sized_from_header and not bytes_streamed:
+                                byte_limit = self.download_byte_limit(file_format, chunk)
+                            proc.stdin.write(chunk)
+                            bytes_streamed += len(chunk)
+                            if byte_limit and bytes_streamed >= byte_limit:
+                                break
+                    except BrokenPipeError:
+                        pass  # fpcalc stopped reading early; its exit status decides the outcome
+                    stdout, _ = proc.communicate(timeout=FPCALC_TIMEOUT)
+                finally:
+                    response.close()
+                    if proc.poll() is None:  # Download error or timeout - don't leave fpcalc behind
+                        proc.kill()
+                        proc.communicate()
+            
+            if bytes_streamed < 1024:
+                logger.warning(f"❌ Downloaded stream too small ({bytes_streamed} bytes): {file_key} - likely error response")
+                return None
+            if proc.returncode != 0:
+                logger.warning(f"❌ fpcalc failed (exit {proc.returncode}): {file_key} - audio could not be decoded from stream")
+                return None
+            
+            result = json.loads(stdout)
+            duration, fingerprint = float(result.get('duration') or 0), result.get('fingerprint')
+            if duration <= 0 or not fingerprint or len(fingerprint) < 10:
+                logger.warning(f"❌ Invalid fpcalc output for {file_key}: duration={duration}")
+                return None
+            
+            return duration, fingerprint, object_size or bytes_streamed
+            
+        except subprocess.TimeoutExpired:
+            logger.warning(f"❌ Timeout during fingerprinting: {file_key}")
+            return None
         except Exception as e:
-            logger.warning(f"⚠️  Failed to delete existing record: {asset_id} - {e}")
+            logger.warning(f"❌ Streamed fingerprint error: {file_key} - {e}")
+            return None
     
-    def flush_fingerprint_batch(self):
-        """Flush accumulated fingerprint records to Snowflake (thread-safe)"""
-        with self.batch_lock:
-            if not self.fingerprint_batch:
-                return
-            
-            batch_to_write = self.fingerprint_batch.copy()
-            self.fingerprint_batch.clear()
-        
-        if not batch_to_write:
-            return
-        
-        insert_sql = """
-        INSERT INTO AI_DATA.AUDIO_FINGERPRINT 
-        (ASSET_ID, FILE_KEY, FORMAT, DURATION, FINGERPRINT, FILE_SIZE, SOURCE, PROCESSING_STATUS)
-        VALUES (%(asset_id)s, %(file_key)s, %(format)s, %(duration)s, %(fingerprint)s, %(file_size)s, %(source)s, 'SUCCESS')
+    def write_records(self, records: List[Dict]):
+        """Write buffered records, choosing the cheaper load path for the batch size"""
+        if len(records) >= STAGED_LOAD_MIN_ROWS:
+            self.stage_and_copy(records)
+        else:
+            self.insert_records(records)
+    
+    def insert_records(self, records: List[Dict]):
+        """Upsert a small batch with one MERGE over a bound VALUES list"""
+        columns = list(STAGED_COLUMNS)
+        row_placeholder = f"({', '.join(['%s'] * len(columns))})"
+        source_sql = f"""
+        SELECT {", ".join(f"column{i} AS {column}" for i, column in enumerate(columns, 1))}
+        FROM VALUES {", ".join([row_placeholder] * len(records))}
         """
+        params = [record.get(column) for record in records for column in columns]
         
+        conn = self.snowflake._get_connection()
+        cursor = conn.cursor()
         try:
-            logger.info(f"💾 Flushing {len(batch_to_write)} fingerprint records to Snowflake...")
-            conn = self.snowflake._get_connection()
-            cursor = conn.cursor()
-            cursor.executemany(insert_sql, batch_to_write)
+            cursor.execute(_merge_sql(source_sql), params)
             conn.commit()
+        finally:
             cursor.close()
-            logger.info(f"✅ Successfully wrote {len(batch_to_write)} fingerprint records")
-        except Exception as e:
-            logger.error(f"❌ Failed to flush fingerprint batch: {e}")
-            raise
     
-    def flush_error_batch(self):
-        """Flush accumulated error records to Snowflake (thread-safe)"""
-        with self.batch_lock:
-            if not self.error_batch:
-                return
-            
-            batch_to_write = self.error_batch.copy()
-            self.error_batch.clear()
+    def stage_and_copy(self, records: List[Dict]):
+        """Bulk-upsert records via a staged Parquet file (PUT + COPY INTO a temp table + MERGE)"""
+        # Imported here: only large flushes need pandas/pyarrow, so --stats and small runs skip the import
+        import pandas as pd
         
-        if not batch_to_write:
-            return
+        df = pd.DataFrame.from_records(records, columns=list(STAGED_COLUMNS)).astype(STAGED_COLUMNS)
         
-        insert_sql = """
-        INSERT INTO AI_DATA.AUDIO_FINGERPRINT 
-        (ASSET_ID, FILE_KEY, FORMAT, FILE_SIZE, SOURCE, PROCESSING_STATUS, ERROR_MESSAGE)
-        VALUES (%(asset_id)s, %(file_key)s, %(format)s, %(file_size)s, %(source)s, 'ERROR', %(error_message)s)
-        """
+        column_list = ", ".join(column.upper() for column in df.columns)
+        select_list = ", ".join(f"$1:{column}" for column in df.columns)
+        # Unique per flush: flushes from different worker threads share one session
+        load_table = f"AI_DATA.AUDIO_FINGERPRINT_LOAD_{uuid.uuid4().hex}"
         
-        try:
-            logger.info(f"💾 Flushing {len(batch_to_write)} error records to Snowflake...")
+        with tempfile.TemporaryDirectory(prefix="audio_fp_stage_") as stage_dir:
+            parquet_path = Path(stage_dir) / f"audio_fp_{uuid.uuid4().hex}.parquet"
+            df.to_parquet(parquet_path, compression='snappy', index=False)
+            
             conn = self.snowflake._get_connection()
             cursor = conn.cursor()
-            cursor.executemany(insert_sql, batch_to_write)
-            conn.commit()
-            cursor.close()
-            logger.info(f"✅ Successfully wrote {len(batch_to_write)} error records")
+            try:
+                cursor.execute(
+                    f"PUT 'file://{parquet_path.as_posix()}' @AI_DATA.%AUDIO_FINGERPRINT "
+                    f"AUTO_COMPRESS=FALSE OVERWRITE=TRUE"
+                )
+                cursor.execute(f"CREATE TEMPORARY TABLE {load_table} LIKE AI_DATA.AUDIO_FINGERPRINT")
+                cursor.execute(f"""
+                COPY INTO {load_table} ({column_list})
+                FROM (SELECT {select_list} FROM @AI_DATA.%AUDIO_FINGERPRINT)
+                FILES = ('{parquet_path.name}')
+                FILE_FORMAT = (TYPE = PARQUET USE_LOGICAL_TYPE = TRUE BINARY_AS_TEXT = FALSE USE_VECTORIZED_SCANNER = TRUE
+                               REPLACE_INVALID_CHARACTERS = TRUE)
+                PURGE = TRUE
+                """)
+                cursor.execute(_merge_sql(f"SELECT {column_list} FROM {load_table}"))
+                conn.commit()
+            finally:
+                try:
+                    cursor.execute(f"DROP TABLE IF EXISTS {load_table}")
+                finally:
+                    cursor.close()
+    
+    def flush_record_batch(self):
+        """Flush accumulated SUCCESS and ERROR records to Snowflake in one load (thread-safe)"""
+        with self.batch_lock:
+            if not self.record_batch:
+                return
+            
+            batch_to_write = self.record_batch
+            self.record_batch = []
+        
+        try:
+            logger.info(f"💾 Flushing {len(batch_to_write)} records to Snowflake...")
+            self.write_records(batch_to_write)
+            logger.info(f"✅ Successfully wrote {len(batch_to_write)} records")
         except Exception as e:
-            logger.error(f"❌ Failed to flush error batch: {e}")
+            logger.error(f"❌ Failed to flush record batch: {e}")
             raise
     
     def flush_all_batches(self):
         """Flush all accumulated batches to Snowflake"""
-        self.flush_fingerprint_batch()
-        self.flush_error_batch()
+        self.flush_record_batch()
+    
+    def buffer_record(self, record: Dict):
+        """Append a record to the batch buffer, flushing once it reaches batch_size (thread-safe)"""
+        with self.batch_lock:
+            self.record_batch.append(record)
+            should_flush = len(self.record_batch) >= self.batch_size
+        
+        # Flush if batch is full (outside lock to avoid blocking other threads)
+        if should_flush:
+            self.flush_record_batch()
     
     def store_fingerprint(self, asset_id: str, file_key: str, format_ext: str, 
-                         duration: float, fingerprint: str, file_size: int, source: str,
-                         is_retry: bool = False):
-        """Store fingerprint in batch buffer (thread-safe)"""
-        # Delete old record if this is a retry
-        if is_retry:
-            self.delete_existing_record(asset_id, file_key)
-        
-        record = {
+                         duration: float, fingerprint: str, file_size: int, source: str):
+        """Store fingerprint in batch buffer (thread-safe); the flush MERGE replaces a stored ERROR row"""
+        self.buffer_record({
             'asset_id': asset_id,
             'file_key': file_key,
             'format': format_ext,
             'duration': duration,
             'fingerprint': fingerprint,
             'file_size': file_size,
-            'source': source
-        }
-        
-        # Add to batch buffer
-        with self.batch_lock:
-            self.fingerprint_batch.append(record)
-            should_flush = len(self.fingerprint_batch) >= self.batch_size
-        
-        # Flush if batch is full (outside lock to avoid blocking other threads)
-        if should_flush:
-            self.flush_fingerprint_batch()
+            'source': source,
+            'processing_status': 'SUCCESS'
+        })
     
     def store_error(self, asset_id: str, file_key: str, format_ext: str, 
-                   file_size: int, source: str, error_message: str, is_retry: bool = False):
-        """Store processing error in batch buffer (thread-safe)"""
-        # Delete old record if this is a retry
-        if is_retry:
-            self.delete_existing_record(asset_id, file_key)
-        
-        record = {
+                   file_size: int, source: str, error_message: str):
+        """Store processing error in batch buffer (thread-safe); the flush MERGE replaces a stored ERROR row"""
+        self.buffer_record({
             'asset_id': asset_id,
             'file_key': file_key,
             'format': format_ext,
             'file_size': file_size,
             'source': source,
-            'error_message': error_message
-        }
-        
-        # Add to batch buffer
-        with self.batch_lock:
-            self.error_batch.append(record)
-            should_flush = len(self.error_batch) >= self.batch_size
-        
-        # Flush if batch is full (outside lock to avoid blocking other threads)
-        if should_flush:
-            self.flush_error_batch()
+            # Exception text can carry undecodable bytes (e.g. surrogate-escaped filenames)
+            'error_message': error_message.encode('utf-8', 'replace').decode('utf-8'),
+            'processing_status': 'ERROR'
+        })
     
-    def process_single_asset(self, asset_data: Dict, is_retry: bool = False) -> bool:
+    def process_single_asset(self, asset_data: Asset, is_retry: bool = False) -> bool:
         """Process a single asset (thread-safe version) with enhanced error handling"""
-        asset_id = asset_data['ASSET_ID']
-        file_key = asset_data['FILE_KEY']
-        file_format = asset_data.get('FILE_FORMAT', 'mp3')
-        file_size = asset_data.get('FILE_SIZE', 0)
-        source = asset_data.get('SOURCE', 'artlist')
+        asset_id = asset_data.ASSET_ID
+        file_key = asset_data.FILE_KEY
+        file_format = asset_data.FILE_FORMAT or 'mp3'
+        file_size = asset_data.FILE_SIZE or 0
+        source = asset_data.SOURCE or 'artlist'
         
         thread_name = threading.current_thread().name
         start_time = time.time()
@@ -689,41 +1162,49 @@ class AudioFingerprintProcessor:
         logger.info(f"🎵 [{thread_name}] {retry_msg}Processing: {asset_id} ({file_key})")
         
         try:
-            temp_dir = self.get_thread_temp_dir()
-            
-            # Download file
-            temp_file = self.download_audio_file(file_key, source, temp_dir)
-            if not temp_file:
-                error_msg = "Download failed - file not available or returned error response"
-                self.store_error(asset_id, file_key, file_format, file_size, source, error_msg, is_retry)
-                return False
-            
-            # Check if downloaded file is valid
-            actual_file_size = temp_file.stat().st_size
-            if actual_file_size < 1024:
-                error_msg = f"Downloaded file too small ({actual_file_size} bytes) - likely API error response"
-                self.store_error(asset_id, file_key, file_format, file_size, source, error_msg, is_retry)
-                return False
-            
-            # Generate fingerprint
-            result = self.generate_fingerprint(temp_file)
-            if not result:
-                error_msg = "Fingerprint generation failed - audio could not be decoded or file corrupted"
-                self.store_error(asset_id, file_key, file_format, file_size, source, error_msg, is_retry)
-                return False
-            
-            duration, fingerprint = result
+            if self.stream_to_fpcalc:
+                # Download straight into fpcalc - no temp file
+                result = self.stream_fingerprint(file_key, source, file_format)
+                if not result:
+                    error_msg = "Streamed fingerprint failed - download error or audio could not be decoded"
+                    self.store_error(asset_id, file_key, file_format, file_size, source, error_msg)
+                    return False
+                
+                duration, fingerprint, actual_file_size = result
+            else:
+                temp_dir = self.get_thread_temp_dir()
+                
+                # Download file
+                downloaded = self.download_audio_file(file_key, source, temp_dir, file_format)
+                if not downloaded:
+                    error_msg = "Download failed - file not available or returned error response"
+                    self.store_error(asset_id, file_key, file_format, file_size, source, error_msg)
+                    return False
+                
+                # Check if downloaded file is valid (FILE_SIZE stores the object size, which a capped
+                # --max-length download only partly fetches)
+                temp_file, actual_file_size = downloaded
+                downloaded_size = temp_file.stat().st_size
+                if downloaded_size < 1024:
+                    error_msg = f"Downloaded file too small ({downloaded_size} bytes) - likely API error response"
+                    self.store_error(asset_id, file_key, file_format, file_size, source, error_msg)
+                    return False
+                
+                # Generate fingerprint
+                result = self.generate_fingerprint(temp_file)
+                if not result:
+                    error_msg = "Fingerprint generation failed - audio could not be decoded or file corrupted"
+                    self.store_error(asset_id, file_key, file_format, file_size, source, error_msg)
+                    return False
+                
+                duration, fingerprint = result
+                
+                # Clean up temp file
+                temp_file.unlink()
             
             # Store in Snowflake
-            self.store_fingerprint(asset_id, file_key, file_format, duration, fingerprint, actual_file_size, source, is_retry)
+            self.store_fingerprint(asset_id, file_key, file_format, duration, fingerprint, actual_file_size, source)
             
-            # Clean up temp file
-            temp_file.unlink()
-            
-            # Update stats (thread-safe)
-            with self.stats_lock:
-                self.stats['successful'] += 1
-                self.stats['processed'] += 1
             processing_time = time.time() - start_time
             logger.info(f"✅ [{thread_name}] {retry_msg}Completed: {asset_id} ({processing_time:.1f}s processing, {duration:.1f}s audio, {actual_file_size:,} bytes)")
             return True
@@ -732,19 +1213,13 @@ class AudioFingerprintProcessor:
             error_msg = f"Processing exception: {str(e)}"
             logger.error(f"❌ [{thread_name}] {retry_msg}Processing failed: {asset_id} - {e}")
             
-            self.store_error(asset_id, file_key, file_format, file_size, source, error_msg, is_retry)
-            
-            # Update stats (thread-safe)
-            with self.stats_lock:
-                self.stats['failed'] += 1
-                self.stats['processed'] += 1
-            
+            self.store_error(asset_id, file_key, file_format, file_size, source, error_msg)
             return False
         finally:
             self.cleanup_thread_temp_dir()
             # Don't cleanup connection here - let it be reused for next asset in same thread
     
-    def process_assets_parallel(self, assets: List[Dict], is_retry: bool = False) -> Dict:
+    def process_assets_parallel(self, assets: List[Asset], is_retry: bool = False) -> Dict:
         """Process assets using parallel processing"""
         if not assets:
             logger.warning("⚠️  No assets to process")
@@ -762,30 +1237,21 @@ class AudioFingerprintProcessor:
                 'start_time': time.time()
             }
         
-        # Process assets in parallel
+        # Process assets in parallel, keeping at most 4 x max_workers futures in flight.
+        # Each future carries its asset in a done-callback, so no future->asset map is kept.
+        total = len(assets)
+        in_flight = threading.BoundedSemaphore(4 * self.max_workers)
         with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            # Submit all tasks
-            future_to_asset = {executor.submit(self.process_single_asset, asset, is_retry): asset for asset in assets}
-            
-            # Process completed tasks
-            for i, future in enumerate(as_completed(future_to_asset), 1):
-                try:
-                    future.result()  # This will raise any exception that occurred
-                except Exception as e:
-                    asset = future_to_asset[future]
-                    logger.error(f"❌ Task failed for asset {asset.get('ASSET_ID', 'unknown')}: {e}")
+            for chunk in _chunked(assets, URL_PREFETCH_SIZE):
+                # Resolve signed URLs for the whole chunk in one API call, just ahead of use
+                self._url_cache.update(self.get_download_urls_from_api([a.FILE_KEY for a in chunk]))
                 
-                # Progress update
-                if i % 10 == 0 or i == len(assets):
-                    with self.stats_lock:
-                        elapsed = time.time() - self.stats['start_time']
-                        rate = self.stats['processed'] / elapsed if elapsed > 0 else 0
-                        eta = (len(assets) - self.stats['processed']) / rate if rate > 0 else 0
-                        
-                        logger.info(f"📈 Progress: {self.stats['processed']}/{len(assets)} "
-                                  f"({self.stats['processed']/len(assets)*100:.1f}%) | "
-                                  f"Rate: {rate:.1f}/sec | ETA: {eta/60:.1f}min | "
-                                  f"Success: {self.stats['successful']} | Failed: {self.stats['failed']}")
+                for asset in chunk:
+                    in_flight.acquire()  # Backpressure: wait for a slot before submitting
+                    future = executor.submit(self.process_single_asset, asset, is_retry)
+                    future.add_done_callback(
+                        lambda f, a=asset: self._on_done(f, a, total, in_flight)
+                    )
         
         # Clean up all thread-local connections after executor completes
         logger.info("Cleaning up thread-local connections...")
@@ -796,22 +1262,48 @@ class AudioFingerprintProcessor:
         logger.info("Flushing remaining batches...")
         self.flush_all_batches()
         
-        # Final results
-        with self.stats_lock:
-            total_time = time.time() - self.stats['start_time']
-            results = {
-                'processed': self.stats['processed'],
-                'successful': self.stats['successful'],
-                'failed': self.stats['failed'],
-                'total_time_minutes': total_time / 60,
-                'rate_per_second': self.stats['processed'] / total_time if total_time > 0 else 0
-            }
+        # Final results (all workers have been joined, so no lock is needed)
+        total_time = time.time() - self.stats['start_time']
+        results = {
+            'processed': self.stats['processed'],
+            'successful': self.stats['successful'],
+            'failed': self.stats['failed'],
+            'total_time_minutes': total_time / 60,
+            'rate_per_second': self.stats['processed'] / total_time if total_time > 0 else 0
+        }
         
         logger.info(f"✅ Parallel processing complete: {results['successful']}/{results['processed']} successful "
                    f"({total_time/60:.1f}min, {results['rate_per_second']:.1f} assets/sec)")
         
         return results
     
+    def _on_done(self, future, asset: Asset, total: int, in_flight: threading.BoundedSemaphore):
+        """Done-callback: count the outcome, surface task errors, log progress and free an in-flight slot"""
+        try:
+            success = future.result()  # This will raise any exception that occurred
+        except Exception as e:
+            success = False
+            logger.error(f"❌ Task failed for asset {asset.ASSET_ID}: {e}")
+        finally:
+            in_flight.release()
+        
+        # Stats are only updated here: one lock acquisition per asset, every outcome counted
+        with self.stats_lock:
+            self.stats['processed'] += 1
+            self.stats['successful' if success else 'failed'] += 1
+            completed = self.stats['processed']
+            
+            # Progress update
+            if completed % 10 == 0 or completed == total:
+                elapsed = time.time() - self.stats['start_time']
+                rate = self.stats['processed'] / elapsed if elapsed > 0 else 0
+                eta = (total - self.stats['processed']) / rate if rate > 0 else 0
+                
+                logger.info(f"📈 Progress: {self.stats['processed']}/{total} "
+                          f"({self.stats['processed']/total*100:.1f}%) | "
+                          f"Rate: {rate:.1f}/sec | ETA: {eta/60:.1f}min | "
+                          f"Success: {self.stats['successful']} | Failed: {self.stats['failed']}")
+    
     def get_processing_stats(self) -> Dict:
         """Get processing statistics from Snowflake"""
         stats_sql = """
@@ -826,7 +1318,7 @@ class AudioFingerprintProcessor:
         """
         
         try:
-            cursor = self.snowflake.execute_query(stats_sql)
+            cursor = self._exec(stats_sql)
             row = cursor.fetchone()
             if row:
                 columns = [desc[0] for desc in cursor.description]
@@ -842,21 +1334,42 @@ def main():
     parser.add_argument('--source', choices=['artlist', 'motionarray'], 
                        help='Process ALL songs from specific source')
     parser.add_argument('--asset-ids', help='Comma-separated list of asset IDs to process')
-    parser.add_argument('--workers', type=int, default=4, 
-                       help='Number of parallel workers (default: 4)')
+    parser.add_argument('--workers', type=int, default=None, 
+                       help='Number of parallel workers (default: min(32, 2 x CPU count))')
     parser.add_argument('--retry-errors', action='store_true',
                        help='Retry processing assets that previously failed with ERROR status')
     parser.add_argument('--stats', action='store_true', help='Show processing statistics')
+    parser.add_argument('--max-length', type=_positive_int, default=FINGERPRINT_MAX_LENGTH,
+                       help=f'Seconds of audio to fingerprint per file (default: {FINGERPRINT_MAX_LENGTH}, whole track). '
+                            'Lower values (e.g. 120) save decode CPU, but fingerprints are matched exactly, '
+                            'so they only compare with fingerprints taken at the same length')
+    parser.add_argument('--stream-to-fpcalc', action='store_true',
+                       help='Pipe downloads directly into fpcalc instead of writing temp files '
+                            '(fpcalc decode path; may not match fingerprints produced by the default path)')
+    parser.add_argument('--tmpdir', default=None,
+                       help='Directory for downloaded temp files, e.g. a tmpfs/RAM disk '
+                            '(default: $FP_TMPDIR, else /dev/shm when it has room, else the system temp dir)')
+    parser.add_argument('--one-file-per-asset', action='store_true',
+                       help='Fingerprint only one file key per asset (WAV preferred over MP3). Roughly halves the work, '
+                            'but cross-asset duplicates that only match on the skipped format will not be found')
     
     args = parser.parse_args()
     
+    if not args.workers:
+        args.workers = default_max_workers()
+        logger.info(f"⚙️  Using {args.workers} workers (auto-selected from {os.cpu_count()} CPUs)")
+    
     # Validate arguments
     if not args.source and not args.asset_ids and not args.stats:
         parser.error("Must specify either --source, --asset-ids, or --stats")
+    tmpdir = args.tmpdir or os.environ.get('FP_TMPDIR')
+    if tmpdir and not _writable_dir(tmpdir):
+        parser.error(f"--tmpdir / FP_TMPDIR is not a writable directory: {tmpdir}")
     
     # Initialize processor
     try:
-        processor = AudioFingerprintProcessor(max_workers=args.workers)
+        processor = AudioFingerprintProcessor(max_workers=args.workers, stream_to_fpcalc=args.stream_to_fpcalc,
+                                              max_length=args.max_length, scratch_dir=args.tmpdir)
         processor.ensure_table_exists()
     except Exception as e:
         logger.error(f"❌ Failed to initialize processor: {e}")
@@ -875,15 +1388,21 @@ def main():
         if args.source:
             retry_msg = " (including ERROR retries)" if args.retry_errors else ""
             logger.info(f"🎯 Processing ALL {args.source} songs{retry_msg}")
-            assets = processor.get_all_assets_by_source(args.source, retry_errors=args.retry_errors)
+            assets = processor.get_all_assets_by_source(args.source, retry_errors=args.retry_errors,
+                                                        one_file_per_asset=args.one_file_per_asset)
         elif args.asset_ids:
-            asset_ids = [aid.strip() for aid in args.asset_ids.split(',')]
+            asset_ids = re.findall(r'[^,\s]+', args.asset_ids)
             logger.info(f"🎯 Processing specific assets: {asset_ids}")
-            assets = processor.get_asset_file_keys(asset_ids)
-            # Note: asset_ids mode doesn't support retry_errors flag currently
+            assets = processor.get_asset_file_keys(asset_ids, retry_errors=args.retry_errors,
+                                                   one_file_per_asset=args.one_file_per_asset)
         else:
             assets = []
         
+        if assets and args.one_file_per_asset:
+            total_found = len(assets)
+            assets = _one_file_per_asset(assets)
+            logger.info(f"⏭️  Skipping {total_found - len(assets)} alternate-format file keys")
+        
         if not assets:
             logger.warning("⚠️  No assets found to process")
             return 0
@@ -0,0 +1,11 @@
+#!/usr/bin/env bash
+# Launch the fingerprint processor with Homebrew's library path on macOS.
+# Usage: bin/run_fingerprinter.sh --source artlist [--workers N ...]
+set -euo pipefail
+
+if [ "$(uname -s)" = "Darwin" ]; then
+    export DYLD_LIBRARY_PATH="/opt/homebrew/lib${DYLD_LIBRARY_PATH:+:$DYLD_LIBRARY_PATH}"
+fi
+
+cd "$(dirname "$0")/.."
+exec "${PYTHON:-python3}" audio_fingerprint_processor.py "$@"
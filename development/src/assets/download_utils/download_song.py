@@ -102,10 +102,9 @@ def download_file(url: str, output_path: str):
     response = requests.get(url, stream=True, timeout=60)
     response.raise_for_status()
     
-    with open(output_path, 'wb') as f:
-        for chunk in response.iter_content(chunk_size=8192):
-            if chunk:
-                f.write(chunk)
+    with open(output_path, 'wb', buffering=1024 * 1024) as f:
+        for chunk in response.iter_content(chunk_size=256 * 1024):
+            f.write(chunk)
 
 
 if __name__ == "__main__":
@@ -408,9 +408,7 @@ def test_sample_records():
         PRODUCT_INDICATOR,
         ASSET_TYPE,
         DUPLICATES
-    FROM BI_PROD.AI_DATA.DUPLICATED_ASSETS
-    ORDER BY RANDOM()
-    LIMIT 5
+    FROM BI_PROD.AI_DATA.DUPLICATED_ASSETS SAMPLE (5 ROWS)
     """
     
     cursor = snowflake.execute_query(query)
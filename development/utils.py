@@ -6,13 +6,17 @@ General utility functions for the bulk downloader.
 import json
 import logging
 import os
+import shutil
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from urllib.parse import urlparse
 import requests
 
 logger = logging.getLogger(__name__)
 
+# Copy/write block size for downloads; override with DOWNLOAD_CHUNK_SIZE when profiling
+DOWNLOAD_CHUNK_SIZE = int(os.environ.get('DOWNLOAD_CHUNK_SIZE', 1024 * 1024))
+
 
 def setup_logging(level: int = logging.INFO) -> None:
     """Configure logging for the application."""
@@ -44,7 +48,8 @@ def extract_filename_from_url(url: str, fallback_key: str) -> str:
     return filename if filename else f"{fallback_key}.bin"
 
 
-def download_file(url: str, file_path: Path, timeout: int = 60) -> bool:
+def download_file(url: str, file_path: Path, timeout: int = 60,
+                  session: Optional[requests.Session] = None) -> bool:
     """
     Download a file from URL to specified path.
     
@@ -52,24 +57,26 @@ def download_file(url: str, file_path: Path, timeout: int = 60) -> bool:
         url: URL to download from
         file_path: Path to save the file
         timeout: Request timeout in seconds
+        session: Optional shared session so batch downloads reuse pooled
+            keep-alive connections instead of a new TLS handshake per file
         
     Returns:
         True if download successful, False otherwise
     """
     try:
-        response = requests.get(url, stream=True, timeout=timeout)
+        response = (session or requests).get(url, stream=True, timeout=timeout)
         response.raise_for_status()
         
-        with open(file_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
+        # Let urllib3 undo any Content-Encoding, then copy the raw stream in large blocks
+        response.raw.decode_content = True
+        with open(file_path, 'wb', buffering=DOWNLOAD_CHUNK_SIZE) as f:
+            shutil.copyfileobj(response.raw, f, length=DOWNLOAD_CHUNK_SIZE)
         
-        logger.info(f"Successfully downloaded: {file_path}")
+        logger.info("Successfully downloaded: %s", file_path)
         return True
         
     except Exception as e:
-        logger.error(f"Failed to download file from {url}: {e}")
+        logger.error("Failed to download file from %s: %s", url, e)
         return False
 
 
@@ -83,15 +90,8 @@ def remove_duplicates_preserve_order(items: List[str]) -> List[str]:
     Returns:
         List with duplicates removed, order preserved
     """
-    unique_items = []
-    seen = set()
-    
-    for item in items:
-        if item not in seen:
-            unique_items.append(item)
-            seen.add(item)
-    
-    return unique_items
+    # dicts keep insertion order, so fromkeys dedups in a single C-level pass
+    return list(dict.fromkeys(items))
 
 
 def extract_keys_from_snowflake_data(data: List[Dict[str, Any]]) -> List[str]:
@@ -134,9 +134,9 @@ def extract_keys_from_snowflake_data(data: List[Dict[str, Any]]) -> List[str]:
                                 format_type = pair.get('format', 'unknown')
                                 keys.append(file_key)
                                 total_pairs += 1
-                                logger.debug(f"Asset {asset_id}: {file_key} ({format_type})")
+                                logger.debug("Asset %s: %s (%s)", asset_id, file_key, format_type)
                     else:
-                        logger.warning(f"Asset {asset_id}: KEY_FORMAT_PAIRS is not a list after parsing")
+                        logger.warning("Asset %s: KEY_FORMAT_PAIRS is not a list after parsing", asset_id)
                 
                 elif isinstance(key_format_pairs_str, list):
                     # Already parsed as list
@@ -146,11 +146,11 @@ def extract_keys_from_snowflake_data(data: List[Dict[str, Any]]) -> List[str]:
                             format_type = pair.get('format', 'unknown')
                             keys.append(file_key)
                             total_pairs += 1
-                            logger.debug(f"Asset {asset_id}: {file_key} ({format_type})")
+                            logger.debug("Asset %s: %s (%s)", asset_id, file_key, format_type)
             
             # Fallback method: Extract from FILE_KEYS array
             elif 'FILE_KEYS' in asset and asset['FILE_KEYS']:
-                logger.info(f"Asset {asset_id}: Using fallback FILE_KEYS method")
+                logger.info("Asset %s: Using fallback FILE_KEYS method", asset_id)
                 file_keys_str = asset['FILE_KEYS']
                 
                 if isinstance(file_keys_str, str):
@@ -165,23 +165,24 @@ def extract_keys_from_snowflake_data(data: List[Dict[str, Any]]) -> List[str]:
                     total_pairs += len(file_keys_str)
             
             else:
-                logger.warning(f"Asset {asset_id}: No KEY_FORMAT_PAIRS or FILE_KEYS found")
+                logger.warning("Asset %s: No KEY_FORMAT_PAIRS or FILE_KEYS found", asset_id)
                     
         except json.JSONDecodeError as e:
-            logger.error(f"Asset {asset_id}: Failed to parse JSON - {e}")
-            logger.error(f"Raw data: {asset.get('KEY_FORMAT_PAIRS', 'N/A')[:200]}...")
+            logger.error("Asset %s: Failed to parse JSON - %s", asset_id, e)
+            logger.error("Raw data: %s...", asset.get('KEY_FORMAT_PAIRS', 'N/A')[:200])
             continue
         except Exception as e:
-            logger.error(f"Asset {asset_id}: Unexpected error extracting keys - {e}")
+            logger.error("Asset %s: Unexpected error extracting keys - %s", asset_id, e)
             continue
     
-    logger.info(f"Successfully extracted {len(keys)} file keys from {len(data)} assets ({total_pairs} total key-format pairs)")
+    logger.info("Successfully extracted %d file keys from %d assets (%d total key-format pairs)",
+                len(keys), len(data), total_pairs)
     
     # Remove duplicates while preserving order
     unique_keys = remove_duplicates_preserve_order(keys)
     
     if len(unique_keys) != len(keys):
-        logger.info(f"Removed {len(keys) - len(unique_keys)} duplicate keys")
+        logger.info("Removed %d duplicate keys", len(keys) - len(unique_keys))
     
     return unique_keys
 
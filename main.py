@@ -4,7 +4,7 @@ from typing import List, Optional
 from fastapi import FastAPI, HTTPException, BackgroundTasks
 from pydantic import BaseModel
 import uvicorn
-from audio_fingerprint_processor import AudioFingerprintProcessor
+from audio_fingerprint_processor import AudioFingerprintProcessor, default_max_workers
 
 # Configure logging
 logging.basicConfig(
@@ -26,7 +26,7 @@ def get_processor():
     global processor
     if processor is None:
         # Initialize with default settings, can be tuned via env vars
-        max_workers = int(os.environ.get("MAX_WORKERS", "4"))
+        max_workers = int(os.environ.get("MAX_WORKERS", default_max_workers()))
         processor = AudioFingerprintProcessor(max_workers=max_workers)
         try:
             processor.ensure_table_exists()
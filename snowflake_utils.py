@@ -9,6 +9,10 @@ from typing import List, Dict, Any, Optional
 
 logger = logging.getLogger(__name__)
 
+# Rows pulled from the driver per fetchmany() call (SnowflakeManager.execute_query and the
+# fingerprint processor's non-Arrow asset fetch)
+FETCH_BATCH_SIZE = 10000
+
 try:
     import snowflake.connector
     from google.cloud import secretmanager
@@ -90,6 +94,9 @@ class SnowflakeConnector:
                 creds["login_timeout"] = 30  # 30 seconds to establish connection
             if "network_timeout" not in creds:
                 creds["network_timeout"] = 60  # 60 seconds for query operations
+            # Long fingerprinting runs hold one session between flushes - keep it from expiring
+            if "client_session_keep_alive" not in creds:
+                creds["client_session_keep_alive"] = True
             
             # Connect
             self._connection = snowflake.connector.connect(**creds)
@@ -216,15 +223,17 @@ class SnowflakeManager(SnowflakeConnector):
         try:
             cursor = self.open_snowflake_cursor()
             cursor.execute(query)
-            results = cursor.fetchall()
             
-            # Convert results to list of dictionaries
+            # Convert results to list of dictionaries batch by batch, so the raw
+            # rows are never held in full alongside the dicts built from them
             columns = [desc[0] for desc in cursor.description]
             data = []
             
-            for row in results:
-                row_dict = dict(zip(columns, row))
-                data.append(row_dict)
+            while True:
+                rows = cursor.fetchmany(FETCH_BATCH_SIZE)
+                if not rows:
+                    break
+                data.extend(dict(zip(columns, row)) for row in rows)
             
             return data
             
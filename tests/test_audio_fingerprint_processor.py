@@ -0,0 +1,404 @@
+import struct
+import threading
+
+import pytest
+
+import audio_fingerprint_processor as afp
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, sql, params=None):
+        self.connection.executed.append((' '.join(sql.split()), params))
+        if self.connection.on_execute:
+            self.connection.on_execute(sql)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self):
+        self.executed = []
+        self.commits = 0
+        self.on_execute = None
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+
+class FakeConnector:
+    def __init__(self):
+        self.connection = FakeConnection()
+
+    def _get_connection(self):
+        return self.connection
+
+    def close(self):
+        pass
+
+
+class FakeResponse:
+    def __init__(self, body: bytes, status_code: int = 200, headers: dict = None):
+        self.body = body
+        self.status_code = status_code
+        self.headers = headers or {'content-type': 'audio/wav'}
+
+    def raise_for_status(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), chunk_size):
+            yield self.body[start:start + chunk_size]
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def make_processor(monkeypatch):
+    monkeypatch.setattr(afp, 'SnowflakeConnector', FakeConnector)
+    monkeypatch.setattr(afp.AudioFingerprintProcessor, 'setup_chromaprint', lambda self: None)
+    processors = []
+
+    def make(**kwargs):
+        processor = afp.AudioFingerprintProcessor(**kwargs)
+        processors.append(processor)
+        return processor
+
+    yield make
+    for processor in processors:
+        processor.close()
+
+
+def wav_header(channels: int, sample_rate: int, bits: int) -> bytes:
+    block_align = channels * bits // 8
+    fmt = struct.pack('<HHIIHH', 1, channels, sample_rate, sample_rate * block_align, block_align, bits)
+    # A LIST chunk ahead of fmt, as written by many DAWs
+    list_chunk = b'LIST' + struct.pack('<I', 5) + b'INFO\x00' + b'\x00'
+    return (b'RIFF' + struct.pack('<I', 0) + b'WAVE' + list_chunk +
+            b'fmt ' + struct.pack('<I', len(fmt)) + fmt + b'data' + struct.pack('<I', 0))
+
+
+def aiff_header(channels: int, sample_rate: int, bits: int) -> bytes:
+    exponent = sample_rate.bit_length() - 1
+    extended = struct.pack('>HQ', 16383 + exponent, sample_rate << (63 - exponent))
+    comm = struct.pack('>HIH', channels, 0, bits) + extended
+    return (b'FORM' + struct.pack('>I', 0) + b'AIFF' +
+            b'COMM' + struct.pack('>I', len(comm)) + comm + b'SSND' + struct.pack('>I', 0))
+
+
+def test_pcm_byte_rate_reads_24_bit_wav_header():
+    assert afp._pcm_byte_rate(wav_header(2, 48000, 24)) == 288_000
+    assert afp._pcm_byte_rate(wav_header(2, 96000, 24)) == 576_000
+
+
+def test_pcm_byte_rate_reads_24_bit_aiff_header():
+    assert afp._pcm_byte_rate(aiff_header(2, 96000, 24)) == 576_000
+
+
+def test_pcm_byte_rate_unknown_header():
+    assert afp._pcm_byte_rate(b'ID3\x04' + bytes(100)) is None
+    assert afp._pcm_byte_rate(wav_header(2, 48000, 24)[:30]) is None
+
+
+def test_byte_limit_covers_24_bit_wav(make_processor):
+    processor = make_processor(max_length=120)
+    head = wav_header(2, 96000, 24)
+    assert processor.download_byte_limit('wav') is None  # Unknown until the header is in
+    assert processor.download_byte_limit('wav', head) == 120 * 576_000 + afp.RANGE_HEADER_ALLOWANCE
+
+
+def test_capped_wav_download_is_not_truncated_before_max_length(make_processor, tmp_path):
+    processor = make_processor(max_length=10)
+    body = wav_header(2, 48000, 24)
+    body += bytes(40 * 288_000 - len(body))  # 40 s of 24-bit/48 kHz stereo
+    requested = []
+
+    def get(url, headers=None, **kwargs):
+        requested.append(headers)
+        return FakeResponse(body, headers={'content-type': 'audio/wav', 'Content-Length': str(len(body))})
+
+    processor.http.get = get
+    processor._url_cache['key.wav'] = 'https://cdn.example.com/key.wav'
+    path, object_size = processor.download_audio_file('key.wav', 'artlist', tmp_path, file_format='wav')
+
+    assert requested == [None]
+    size = path.stat().st_size
+    assert size >= 10 * 288_000 + afp.RANGE_HEADER_ALLOWANCE
+    assert size < len(body)
+    assert object_size == len(body)  # FILE_SIZE is the object's size, not the truncated prefix
+
+
+def id3_header(body_size: int) -> bytes:
+    syncsafe = bytes((body_size >> shift) & 0x7F for shift in (21, 14, 7, 0))
+    return b'ID3\x04\x00\x00' + syncsafe
+
+
+def test_id3v2_size_reads_syncsafe_header():
+    assert afp._id3v2_size(id3_header(3 * 1024 * 1024)) == 10 + 3 * 1024 * 1024
+    assert afp._id3v2_size(b'\xff\xfb\x90\x00' + bytes(6)) == 0
+
+
+def test_capped_mp3_download_covers_large_cover_art(make_processor, tmp_path):
+    processor = make_processor(max_length=10)
+    tag_size = 3 * 1024 * 1024  # Embedded cover art well beyond RANGE_HEADER_ALLOWANCE
+    body = id3_header(tag_size) + bytes(tag_size) + b'\xff' * (30 * 40_000)
+
+    processor.http.get = lambda url, headers=None, **kwargs: FakeResponse(
+        body, headers={'content-type': 'audio/mpeg', 'Content-Length': str(len(body))})
+    processor._url_cache['key.mp3'] = 'https://cdn.example.com/key.mp3'
+    path, object_size = processor.download_audio_file('key.mp3', 'artlist', tmp_path, file_format='mp3')
+
+    assert path.stat().st_size >= 10 + tag_size + 10 * 40_000
+    assert path.stat().st_size < len(body)
+    assert object_size == len(body)
+
+
+def test_concurrent_large_downloads_do_not_share_range_threads(make_processor, monkeypatch, tmp_path):
+    monkeypatch.setattr(afp, 'RANGE_PART_SIZE', 4)
+    processor = make_processor(max_workers=2)
+    parts = afp.RANGE_PARALLELISM
+    # Every part of both files must be in flight at once to get past the barrier
+    barrier = threading.Barrier(2 * parts, timeout=5)
+
+    def get(url, headers=None, **kwargs):
+        barrier.wait()
+        start, end = map(int, headers['Range'][len('bytes='):].split('-'))
+        return FakeResponse(url[-1:].encode() * (end - start + 1), status_code=206)
+
+    paths = [tmp_path / 'a', tmp_path / 'b']
+    for path in paths:
+        path.write_bytes(b'head')
+    processor.http.get = get
+    errors = []
+
+    def download(path):
+        try:
+            processor.download_remaining_parts(f'https://bucket.s3.amazonaws.com/{path.name}', path, 4, 4 + 4 * parts)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=download, args=(path,)) for path in paths]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    for path in paths:
+        assert path.read_bytes() == b'head' + path.name.encode() * (4 * parts)
+
+
+class RowCursor:
+    """Cursor without a usable Arrow fetch (e.g. connector installed without its [pandas] extra)"""
+
+    def __init__(self, rows):
+        self.rows = list(rows)
+
+    def fetch_arrow_batches(self):
+        raise ImportError("pyarrow is not installed")
+
+    def fetchmany(self, size):
+        batch, self.rows = self.rows[:size], self.rows[size:]
+        return batch
+
+
+def test_fetch_assets_falls_back_to_fetchmany_without_arrow():
+    rows = [('1', 'key-1', 'wav', 0, 'artlist'), ('2', 'key-2', 'mp3', 0, 'motionarray')]
+    assert afp._fetch_assets_arrow(RowCursor(rows)) == [afp.Asset._make(row) for row in rows]
+
+
+def test_source_query_failure_is_not_an_empty_backlog(make_processor):
+    processor = make_processor()
+
+    def fail(sql, params=None):
+        raise RuntimeError("connection lost")
+
+    processor._exec = fail
+    with pytest.raises(RuntimeError):
+        processor.get_all_assets_by_source('artlist')
+
+
+def test_one_file_per_asset_prefers_wav():
+    mp3 = afp.Asset('1', 'key-mp3', 'mp3', 0, 'artlist')
+    wav = afp.Asset('1', 'key-wav', 'wav', 0, 'artlist')
+    assert afp._one_file_per_asset([mp3, wav]) == [wav]
+
+
+def test_one_file_per_asset_source_query_skips_fingerprinted_assets(make_processor):
+    processor = make_processor()
+    for source in ('artlist', 'motionarray'):
+        assert "done.processing_status = 'SUCCESS'" in processor._source_sql[(source, False, True)]
+        assert "done.processing_status" not in processor._source_sql[(source, False, False)]
+
+
+def test_one_file_per_asset_rerun_skips_leftover_format(make_processor):
+    processor = make_processor()
+    executed = []
+
+    class Cursor(RowCursor):
+        def fetchall(self):
+            return self.rows
+
+    def execute(sql, params=None):
+        executed.append((sql, params))
+        if 'DISTINCT ASSET_ID' in sql:
+            return Cursor([('1',)])  # Asset 1's WAV was fingerprinted on the previous run
+        if 'SELECT ASSET_ID, FILE_KEY' in sql:
+            return Cursor([('1', 'key-1-wav')])
+        return Cursor([
+            ('1', 'key-1-wav', 'wav', 0, 'artlist'),
+            ('1', 'key-1-mp3', 'mp3', 0, 'artlist'),
+            ('2', 'key-2-mp3', 'mp3', 0, 'artlist'),
+            ('2', 'key-2-wav', 'wav', 0, 'artlist'),
+        ])
+
+    processor._exec = execute
+    assets = processor.get_asset_file_keys(['1', '2'], one_file_per_asset=True)
+
+    assert afp._one_file_per_asset(assets) == [afp.Asset('2', 'key-2-wav', 'wav', 0, 'artlist')]
+    # The SUCCESS lookup is scoped to the requested IDs, not the whole table
+    lookup_sql, lookup_params = next(call for call in executed if 'DISTINCT ASSET_ID' in call[0])
+    assert lookup_params == {'ids': '["1", "2"]'}
+
+
+def test_stream_fingerprint_opens_download_inside_decode_slot(make_processor):
+    processor = make_processor()
+    processor.fingerprint_slots = threading.BoundedSemaphore(1)
+    slot_held = []
+
+    def get(url, **kwargs):
+        slot_held.append(not processor.fingerprint_slots.acquire(blocking=False))
+        raise ConnectionError("connection reset")
+
+    processor.http.get = get
+    processor._url_cache['key.mp3'] = 'https://cdn.example.com/key.mp3'
+
+    assert processor.stream_fingerprint('key.mp3', 'artlist', 'mp3') is None
+    assert slot_held == [True]
+
+
+@pytest.mark.parametrize('value', ['0', '-5'])
+def test_max_length_rejects_non_positive_values(value):
+    with pytest.raises(afp.argparse.ArgumentTypeError):
+        afp._positive_int(value)
+
+
+@pytest.mark.parametrize('host', [
+    'bucket.s3.amazonaws.com',
+    'bucket.s3.eu-west-1.amazonaws.com',
+    's3.eu-west-1.amazonaws.com',
+    's3-eu-west-1.amazonaws.com',  # Legacy path-style regional endpoint
+    'bucket.s3-eu-west-1.amazonaws.com',
+])
+def test_is_s3_url(host):
+    assert afp._is_s3_url(f'https://{host}/key.wav?X-Amz-Signature=abc')
+
+
+def test_is_s3_url_rejects_other_hosts():
+    assert not afp._is_s3_url('https://cdn.example.com/key.wav')
+    assert not afp._is_s3_url('https://ec2.amazonaws.com/key.wav')
+
+
+def test_unusable_scratch_dir_is_rejected_at_startup(make_processor, tmp_path):
+    with pytest.raises(ValueError):
+        make_processor(scratch_dir=str(tmp_path / 'missing'))
+    assert make_processor(scratch_dir=str(tmp_path)).scratch_dir == str(tmp_path)
+
+
+def fingerprint_record(asset_id):
+    return {'asset_id': asset_id, 'file_key': f'key-{asset_id}', 'format': 'wav', 'duration': 120.5,
+            'fingerprint': 'AQAA' * 4, 'file_size': 2048, 'source': 'artlist', 'processing_status': 'SUCCESS'}
+
+
+def error_record(asset_id):
+    return {'asset_id': asset_id, 'file_key': f'key-{asset_id}', 'format': 'mp3', 'file_size': 0,
+            'source': 'motionarray', 'error_message': 'Download failed', 'processing_status': 'ERROR'}
+
+
+def test_small_batch_is_merged_from_bound_values(make_processor):
+    processor = make_processor()
+    records = [fingerprint_record('1'), error_record('2')]
+
+    processor.write_records(records)
+
+    connection = processor.snowflake.connection
+    [(sql, params)] = connection.executed
+    columns = list(afp.STAGED_COLUMNS)
+    row = '(' + ', '.join(['%s'] * len(columns)) + ')'
+    assert sql.startswith('MERGE INTO AI_DATA.AUDIO_FINGERPRINT t USING ( SELECT column1 AS asset_id, column2 AS file_key')
+    assert f'FROM VALUES {row}, {row} ) s' in sql
+    assert 'ON t.ASSET_ID = s.asset_id AND t.FILE_KEY = s.file_key' in sql
+    assert "WHEN MATCHED AND t.PROCESSING_STATUS = 'ERROR' THEN UPDATE SET FORMAT = s.format," in sql
+    assert 'UPDATED_AT = CURRENT_TIMESTAMP()' in sql
+    assert f"WHEN NOT MATCHED THEN INSERT ({', '.join(c.upper() for c in columns)})" in sql
+    # Flattened row-major in STAGED_COLUMNS order, missing fields bound as NULL
+    assert params == [
+        '1', 'key-1', 'wav', 120.5, 'AQAA' * 4, 2048, 'artlist', None, 'SUCCESS',
+        '2', 'key-2', 'mp3', None, None, 0, 'motionarray', 'Download failed', 'ERROR',
+    ]
+    assert connection.commits == 1
+
+
+def test_large_batch_is_staged_as_parquet_and_merged(make_processor, monkeypatch):
+    pd = pytest.importorskip('pandas')
+    monkeypatch.setattr(afp, 'STAGED_LOAD_MIN_ROWS', 3)
+    processor = make_processor()
+    records = [fingerprint_record('1'), error_record('2'), fingerprint_record('3')]
+    staged = []
+
+    def read_staged_file(sql):
+        if sql.startswith('PUT'):
+            staged.append(pd.read_parquet(sql.split("'")[1][len('file://'):]))
+
+    connection = processor.snowflake.connection
+    connection.on_execute = read_staged_file
+    processor.write_records(records)
+
+    statements = [sql for sql, _ in connection.executed]
+    assert [sql.split()[0] for sql in statements] == ['PUT', 'CREATE', 'COPY', 'MERGE', 'DROP']
+    load_table = statements[1].split()[3]
+    assert load_table.startswith('AI_DATA.AUDIO_FINGERPRINT_LOAD_')
+    assert statements[1] == f'CREATE TEMPORARY TABLE {load_table} LIKE AI_DATA.AUDIO_FINGERPRINT'
+    column_list = ', '.join(c.upper() for c in afp.STAGED_COLUMNS)
+    assert statements[2].startswith(f'COPY INTO {load_table} ({column_list})')
+    assert 'REPLACE_INVALID_CHARACTERS = TRUE' in statements[2]
+    assert f'USING (SELECT {column_list} FROM {load_table}) s' in statements[3]
+    assert statements[4] == f'DROP TABLE IF EXISTS {load_table}'
+    assert all(params is None for _, params in connection.executed)
+    assert connection.commits == 1
+
+    [frame] = staged
+    assert list(frame.columns) == list(afp.STAGED_COLUMNS)
+    assert frame['asset_id'].tolist() == ['1', '2', '3']
+    assert frame['processing_status'].tolist() == ['SUCCESS', 'ERROR', 'SUCCESS']
+
+
+def test_staged_load_drops_temp_table_when_merge_fails(make_processor, monkeypatch):
+    pytest.importorskip('pandas')
+    monkeypatch.setattr(afp, 'STAGED_LOAD_MIN_ROWS', 1)
+    processor = make_processor()
+
+    def fail_merge(sql):
+        if sql.lstrip().startswith('MERGE'):
+            raise RuntimeError('merge failed')
+
+    connection = processor.snowflake.connection
+    connection.on_execute = fail_merge
+    with pytest.raises(RuntimeError):
+        processor.write_records([fingerprint_record('1')])
+
+    assert connection.executed[-1][0].startswith('DROP TABLE IF EXISTS AI_DATA.AUDIO_FINGERPRINT_LOAD_')
+    assert connection.commits == 0